@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import io
+import logging
+
+from PIL import Image, ImageFont
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+# Upper bound for the decoded pixel data kept around
+MAX_BYTES = 8 * 1024 * 1024
+
+cache = OrderedDict()
+cache_bytes = 0
+
+
+def remove_transparency(im, bg_colour=WHITE):
+    # Only process if image has transparency (http://stackoverflow.com/a/1963146)
+    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+
+        # Need to convert to RGBA if LA format due to a bug in PIL (http://stackoverflow.com/a/1963146)
+        alpha = im.convert('RGBA').split()[-1]
+
+        # Create a new background image of our matt color.
+        # Must be RGBA because paste requires both images have the same format
+        # (http://stackoverflow.com/a/8720632  and  http://stackoverflow.com/a/9459208)
+        bg = Image.new("RGBA", im.size, bg_colour + (255,))
+        bg.paste(im, mask=alpha)
+        return bg
+
+    else:
+        return im
+
+
+def image_bytes(im):
+    return im.width * im.height * len(im.getbands())
+
+
+# Returns the image at path, flattened onto matte (if given), resized to size
+# (if given) and converted to mode (if given). The result is shared between
+# callers and must not be modified.
+def load(path, size=None, matte=None, mode=None):
+    global cache_bytes
+
+    key = (path, size, matte, mode)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    im = Image.open(path)
+    if matte is not None:
+        im = remove_transparency(im, matte)
+    if size is not None:
+        im = im.resize(size)
+    if mode is not None and im.mode != mode:
+        im = im.convert(mode)
+    im.load()
+
+    cache[key] = im
+    cache_bytes += image_bytes(im)
+
+    while cache_bytes > MAX_BYTES and len(cache) > 1:
+        (_, evicted) = cache.popitem(last=False)
+        cache_bytes -= image_bytes(evicted)
+        logging.debug("Evicted image from asset cache")
+
+    return im
+
+
+# Takes (path, size, matte, mode) tuples
+def preload(specs):
+    for spec in specs:
+        load(*spec)
+
+
+font_files = {}
+
+
+def font_data(path):
+    if path not in font_files:
+        with open(path, "rb") as f:
+            font_files[path] = f.read()
+
+    return font_files[path]
+
+
+# Takes a dict of name -> (path, size) and loads each font when it is first
+# used. Each file is only read once, however many sizes of it are used.
+class Fonts:
+    def __init__(self, specs):
+        self.specs = specs
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            (path, size) = self.specs[name]
+            self.loaded[name] = ImageFont.truetype(
+                io.BytesIO(font_data(path)), size)
+
+        return self.loaded[name]
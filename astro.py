@@ -1,5 +1,8 @@
+from datetime import date, datetime, timedelta
 from enum import Enum
+from typing import NamedTuple
 from astral import moon, LocationInfo
+from astral.sun import sun, golden_hour
 
 city = LocationInfo("Berlin", "Germany", "Europe/Berlin", 52.562923, 13.328471)
 
@@ -52,3 +55,54 @@ def get_moon_phase(date):
         return MoonPhase.THIRD_QUARTER
     else:
         return MoonPhase.WANING_CRESCENT
+
+
+# Everything about the sky over city that only changes once a day
+class Ephemeris(NamedTuple):
+    dawn: datetime
+    sunrise: datetime
+    dusk: datetime
+    golden_hour: datetime  # Start of the morning golden hour
+    moon: MoonPhase
+
+
+# How many days are computed at once when a day is missing from the table
+AHEAD = 7
+
+ephemerides = {}
+
+
+def compute_ephemeris(day):
+    s = sun(city.observer, date=day, tzinfo=city.timezone)
+    golden = golden_hour(city.observer, day, tzinfo=city.timezone)[0]
+    return Ephemeris(s["dawn"], s["sunrise"], s["dusk"], golden, get_moon_phase(day))
+
+
+# Fills the table for days days from start on (e.g. 366 for a whole year)
+# and drops the days before it. The render thread and the forecast's thread
+# both use the table, so it is never changed in place: a new one is built
+# and swapped in, and returned.
+def build_table(start, days=AHEAD):
+    global ephemerides
+
+    table = {d: e for (d, e) in ephemerides.items() if d >= start - timedelta(days=1)}
+    for i in range(days):
+        day = start + timedelta(days=i)
+        if day not in table:
+            table[day] = compute_ephemeris(day)
+
+    ephemerides = table
+    return table
+
+
+# Takes a date or a datetime, in which case its date in its own timezone is
+# used (like astral does)
+def ephemeris(day):
+    if isinstance(day, datetime):
+        day = day.date()
+
+    table = ephemerides
+    if day not in table:
+        table = build_table(day)
+
+    return table[day]
@@ -0,0 +1,480 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+import display
+
+# Every backend has the same four methods:
+#   open(size)                  prepare the output for frames of this size
+#   show(image, frame, boxes)   present a frame; image is the 8 bit rendering,
+#                               frame its 1 bit version and boxes the changed
+#                               regions since the last frame (None: everything)
+#   run(refresh, interval)      call refresh every interval seconds, forever;
+#                               interval may also be a function returning the
+#                               seconds until the next refresh
+#   close()                     release the output after a fatal error
+
+
+def seconds(interval):
+    return interval() if callable(interval) else interval
+
+
+class Backend:
+    def open(self, size):
+        pass
+
+    def show(self, image, frame, boxes):
+        raise NotImplementedError
+
+    def run(self, refresh, interval):
+        while True:
+            refresh()
+            time.sleep(seconds(interval))
+
+    def close(self):
+        pass
+
+
+# Keeps the latest frame in memory and, given a directory, writes every frame
+# to it as a numbered PNG
+class Sink(Backend):
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.frame = None
+        self.boxes = None
+        self.frames = 0
+
+    def open(self, size):
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def show(self, image, frame, boxes):
+        self.frame = frame
+        self.boxes = boxes
+        self.frames += 1
+
+        if self.directory is not None:
+            frame.save(os.path.join(self.directory, f"frame-{self.frames:05d}.png"))
+
+
+# A window on the desktop, what --debug used to open
+class Tk(Backend):
+    def open(self, size):
+        import tkinter as tk
+
+        self.root = tk.Tk()
+        self.root.geometry(f"{size[0]}x{size[1]}")
+        self.label = tk.Label(self.root)
+        self.label.pack()
+
+    def show(self, image, frame, boxes):
+        from PIL import ImageTk
+
+        self.tkimg = ImageTk.PhotoImage(image)
+        self.label.configure(image=self.tkimg)
+
+    def run(self, refresh, interval):
+        def tick():
+            refresh()
+            self.root.after(int(1000 * seconds(interval)), tick)
+
+        self.root.after(100, tick)
+        self.root.mainloop()
+
+
+# Draws into a Linux framebuffer device such as an HDMI or SPI TFT screen,
+# in the top left corner. Frames are black and white, so only the pixel size
+# matters and not the channel order.
+class Framebuffer(Backend):
+    def __init__(self, device="/dev/fb0"):
+        self.device = device
+
+    def open(self, size):
+        sysfs = os.path.join("/sys/class/graphics", os.path.basename(self.device))
+
+        def read(name):
+            with open(os.path.join(sysfs, name)) as f:
+                return f.read().strip()
+
+        (width, height) = read("virtual_size").split(",")
+        self.resolution = (int(width), int(height))
+        self.depth = int(read("bits_per_pixel")) // 8
+        self.stride = int(read("stride"))
+        self.fb = open(self.device, "r+b", buffering=0)
+
+        if self.depth not in (1, 2, 4):
+            raise ValueError(f"Unsupported framebuffer depth {self.depth * 8}")
+
+    def pixels(self, frame):
+        gray = frame.convert("L")
+        if self.depth == 1:
+            return gray
+        if self.depth == 2:
+            return Image.merge("LA", (gray, gray))
+        return gray.convert("RGBX")
+
+    def show(self, image, frame, boxes):
+        if boxes is None:
+            boxes = [(0, 0, frame.width, frame.height)]
+
+        (width, height) = self.resolution
+        for (left, top, right, bottom) in boxes:
+            (right, bottom) = (min(right, width), min(bottom, height))
+            if left >= right or top >= bottom:
+                continue
+
+            data = self.pixels(frame.crop((left, top, right, bottom))).tobytes()
+            row = (right - left) * self.depth
+            for y in range(top, bottom):
+                self.fb.seek(y * self.stride + left * self.depth)
+                self.fb.write(data[(y - top) * row:(y - top + 1) * row])
+
+    def close(self):
+        self.fb.close()
+
+
+# The Waveshare 7.5" HD panel. Small changes are sent as partial updates,
+# with a full refresh every so often to clear the ghosting they leave.
+class Panel(Backend):
+    def __init__(self, epd=None):
+        self.epd = epd
+        self.frame = None
+        self.partial_updates = 0
+
+    def open(self, size):
+        if self.epd is None:
+            from waveshare_epd import epd7in5_HD
+            self.epd = epd7in5_HD.EPD()
+
+        self.epd.init()
+        self.epd.Clear()
+
+    def show(self, image, frame, boxes):
+        if boxes is not None and self.can_update_partially(boxes, frame):
+            logging.info(f"Partial update of {len(boxes)} regions")
+            display.display_partial(self.epd, self.frame, frame, boxes)
+            self.partial_updates += 1
+        else:
+            buffer = display.pack(frame, self.epd.width, self.epd.height)
+            self.epd.display(buffer)
+            display.sync_previous(self.epd, buffer)
+            self.partial_updates = 0
+
+        self.frame = frame
+
+    def can_update_partially(self, boxes, frame):
+        if self.frame is None or self.partial_updates >= display.FULL_REFRESH_EVERY:
+            return False
+
+        if not all(display.window_fits(b) for b in boxes):
+            return False
+
+        return display.use_partial(boxes, frame.size)
+
+    def close(self):
+        from waveshare_epd import epd7in5_HD
+        epd7in5_HD.epdconfig.module_exit()
+
+
+# epdconfig drives the SPI bus at 4 MHz
+SPI_HZ = 4_000_000
+
+# Rough refresh durations of the 7.5" HD panel at room temperature
+FULL_REFRESH = 4.0
+PARTIAL_REFRESH = 1.2
+
+# The Y address range the driver sets up, see display.ram_row
+RAM_ROWS = 0x2B0
+
+
+# Stands in for epd7in5_HD.EPD. It interprets the controller commands that the
+# driver and display.py send, keeps both RAM banks and shows what the panel
+# would show after each refresh in self.panel. Transfer and refresh time is
+# accounted for in self.elapsed and, with realtime, actually waited for.
+class EmulatedEPD:
+    width = 880
+    height = 528
+
+    def __init__(self, spi_hz=SPI_HZ, full_refresh=FULL_REFRESH,
+                 partial_refresh=PARTIAL_REFRESH, realtime=False):
+        self.spi_hz = spi_hz
+        self.refresh_time = {0xF7: full_refresh, 0xFF: partial_refresh}
+        self.realtime = realtime
+
+        self.row_bytes = self.width // 8
+        self.ram = {0x24: bytearray(b"\xff" * RAM_ROWS * self.row_bytes),
+                    0x26: bytearray(b"\xff" * RAM_ROWS * self.row_bytes)}
+        self.panel = Image.new("1", (self.width, self.height), 1)
+
+        self.command = None
+        self.arguments = []
+        self.sequence = 0xF7
+        self.busy = 0.0
+
+        self.elapsed = 0.0
+        self.bytes_sent = 0
+        self.updates = {"full": 0, "partial": 0}
+
+    def init(self):
+        self.x_window = (0, self.width - 1)
+        self.y_window = (RAM_ROWS - 1, 0)
+        (self.x, self.y) = (0, 0)
+
+    # What the driver does
+    def getbuffer(self, image):
+        if image.size == (self.height, self.width):
+            image = image.rotate(90, expand=True)
+        return bytearray(image.convert("1").tobytes("raw"))
+
+    def Clear(self):
+        buffer = [0xFF] * (self.row_bytes * self.height)
+        self.send_command(0x4F)
+        self.send_data2([0x00, 0x00])
+        self.send_command(0x24)
+        self.send_data2(buffer)
+        self.send_command(0x4F)
+        self.send_data2([0x00, 0x00])
+        self.send_command(0x26)
+        self.send_data2(buffer)
+        self.send_command(0x22)
+        self.send_data(0xF7)
+        self.send_command(0x20)
+        self.ReadBusy()
+
+    def display(self, buffer):
+        self.send_command(0x4F)
+        self.send_data2([0x00, 0x00])
+        self.send_command(0x24)
+        self.send_data2(buffer)
+        self.send_command(0x22)
+        self.send_data(0xF7)
+        self.send_command(0x20)
+        self.ReadBusy()
+
+    def sleep(self):
+        pass
+
+    def transfer(self, count):
+        self.bytes_sent += count
+        duration = count * 8 / self.spi_hz
+        self.elapsed += duration
+        if self.realtime:
+            time.sleep(duration)
+
+    def send_command(self, command):
+        self.transfer(1)
+        self.command = command
+        self.arguments = []
+
+        if command == 0x20:
+            self.refresh()
+
+    def send_data(self, data):
+        self.send_data2([data])
+
+    def send_data2(self, data):
+        self.transfer(len(data))
+
+        if self.command in self.ram:
+            self.write_ram(self.ram[self.command], data)
+            return
+
+        self.arguments.extend(data)
+        args = self.arguments
+        if self.command == 0x44 and len(args) == 4:
+            self.x_window = (args[0] | args[1] << 8, args[2] | args[3] << 8)
+        elif self.command == 0x45 and len(args) == 4:
+            self.y_window = (args[0] | args[1] << 8, args[2] | args[3] << 8)
+        elif self.command == 0x4E and len(args) == 2:
+            self.x = args[0] | args[1] << 8
+        elif self.command == 0x4F and len(args) == 2:
+            self.y = args[0] | args[1] << 8
+        elif self.command == 0x22:
+            self.sequence = args[0]
+
+    # X counts up and Y down (data entry mode 0x01), both wrap around
+    # inside the window
+    def write_ram(self, ram, data):
+        (x_start, x_end) = self.x_window
+        (y_start, y_end) = self.y_window
+
+        data = bytes(data)
+        while len(data) > 0:
+            count = min(len(data), (x_end - self.x) // 8 + 1)
+            start = self.y * self.row_bytes + self.x // 8
+            ram[start:start + count] = data[:count]
+            data = data[count:]
+
+            self.x += 8 * count
+            if self.x > x_end:
+                self.x = x_start
+                self.y = y_start if self.y == y_end else (self.y - 1) % RAM_ROWS
+
+    def refresh(self):
+        rows = []
+        for y in range(self.height):
+            start = display.ram_row(y) * self.row_bytes
+            rows.append(self.ram[0x24][start:start + self.row_bytes])
+        self.panel = Image.frombytes("1", (self.width, self.height), b"".join(rows))
+
+        self.updates["partial" if self.sequence == 0xFF else "full"] += 1
+        self.busy = self.refresh_time.get(self.sequence, 0.0)
+
+    def ReadBusy(self):
+        self.elapsed += self.busy
+        if self.realtime:
+            time.sleep(self.busy)
+        self.busy = 0.0
+
+
+# The panel code path with an EmulatedEPD in place of the hardware. Logs what
+# every update cost, so full and partial updates can be compared at the desk.
+# With "emulated:realtime" it also takes as long as the panel would.
+class EmulatedPanel(Panel):
+    def __init__(self, mode=None):
+        super().__init__(EmulatedEPD(realtime=mode == "realtime"))
+
+    def show(self, image, frame, boxes):
+        (elapsed, sent) = (self.epd.elapsed, self.epd.bytes_sent)
+        super().show(image, frame, boxes)
+
+        logging.info(f"Emulated update: {(self.epd.bytes_sent - sent) / 1024:.1f} KiB, "
+                     f"{self.epd.elapsed - elapsed:.2f} s")
+
+        if self.epd.panel.tobytes() != frame.tobytes():
+            logging.warning("Emulated panel does not show the frame")
+
+    def close(self):
+        pass
+
+
+class Frame(NamedTuple):
+    etag: str
+    size: tuple
+    png: bytes
+    buffer: bytes
+
+
+# Longest a client may wait for the next frame in one request
+MAX_WAIT = 120
+
+
+def frame_handler(server):
+    from http.server import BaseHTTPRequestHandler
+
+    class FrameHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/frame.png":
+                content_type = "image/png"
+            elif url.path == "/frame.epd":
+                content_type = "application/octet-stream"
+            else:
+                self.respond(404)
+                return
+
+            etag = self.headers.get("If-None-Match")
+            try:
+                wait = min(float(parse_qs(url.query).get("wait", ["0"])[0]), MAX_WAIT)
+            except ValueError:
+                self.respond(400)
+                return
+
+            frame = server.next_frame(etag, wait)
+            if frame is None:
+                self.respond(503)
+            elif frame.etag == etag:
+                self.respond(304, frame)
+            elif content_type == "image/png":
+                self.respond(200, frame, content_type, frame.png)
+            else:
+                self.respond(200, frame, content_type, frame.buffer)
+
+        def respond(self, status, frame=None, content_type=None, body=b""):
+            self.send_response(status)
+            if frame is not None:
+                self.send_header("ETag", frame.etag)
+                self.send_header("X-Frame-Size", f"{frame.size[0]}x{frame.size[1]}")
+            if content_type is not None:
+                self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return FrameHandler
+
+
+# Renders for any number of screens: every frame is encoded once, as PNG and
+# as a packed panel buffer (see display.pack), and served over HTTP at
+# /frame.png and /frame.epd. Requests with If-None-Match get 304 while the
+# frame is unchanged and, with ?wait=<seconds>, are held until the next
+# frame instead. client.py shows the frames on a display.
+class Server(Backend):
+    def __init__(self, port="8080"):
+        self.port = int(port)
+        self.frame = None
+        self.changed = threading.Condition()
+
+    def open(self, size):
+        from http.server import ThreadingHTTPServer
+
+        self.httpd = ThreadingHTTPServer(("", self.port), frame_handler(self))
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever,
+                         name="frame server", daemon=True).start()
+        logging.info(f"Serving frames on port {self.port}")
+
+    def show(self, image, frame, boxes):
+        png = io.BytesIO()
+        frame.save(png, "PNG")
+        buffer = display.pack(frame, frame.width, frame.height)
+        etag = '"' + hashlib.blake2b(buffer, digest_size=8).hexdigest() + '"'
+
+        with self.changed:
+            self.frame = Frame(etag, frame.size, png.getvalue(), buffer)
+            self.changed.notify_all()
+
+    # Returns the current frame, after waiting up to wait seconds for it to
+    # differ from etag
+    def next_frame(self, etag, wait):
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.frame is not None and self.frame.etag != etag, wait)
+            return self.frame
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+BACKENDS = {
+    "epd": Panel,
+    "tk": Tk,
+    "png": Sink,
+    "fb": Framebuffer,
+    "emulated": EmulatedPanel,
+    "serve": Server,
+}
+
+
+# Takes "name" or "name:argument", e.g. "png:frames", "fb:/dev/fb1" or
+# "serve:8080"
+def create(spec):
+    (name, _, argument) = spec.partition(":")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown display backend {name}")
+
+    if argument:
+        return BACKENDS[name](argument)
+    return BACKENDS[name]()
@@ -0,0 +1,448 @@
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import httpx
+from PIL import Image
+
+import backends
+import departures
+import display
+import policy
+import flur
+import scheduler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Directions and change stations as they come from transport.rest for
+# U Afrikanische Straße
+DIRECTIONS = [
+    "U Alt-Tegel",
+    "U Alt-Mariendorf",
+    "U Kurt-Schumacher-Platz",
+    "U Borsigwerke",
+    "U Seestraße",
+    "S+U Wedding (Berlin)",
+    "U Naturkundemuseum",
+    "U Hallesches Tor",
+    "U Mehringdamm",
+    "U Platz der Luftbrücke",
+    "S+U Tempelhof (Berlin)",
+    "S+U Hauptbahnhof",
+    "U Osloer Str.",
+    "Betriebshof Indira-Gandhi-Str.",
+    "S Westend (Berlin)",
+    "S+U Friedrichstr. Bhf (Berlin)",
+    "U Rathaus Steglitz",
+    "Flughafen BER Terminal 1-2",
+    "S+U Gesundbrunnen Bhf (Berlin)",
+    "U Friedrich-Ludwig-Jahn-Sportpark",
+]
+
+
+# How normalize_station_name used to work, with a re.sub call per rule
+def normalize_with_re_sub(name):
+    for (pattern, repl) in departures.STATION_RULES:
+        name = re.sub(pattern.pattern, repl, name)
+    return name
+
+
+def report(label, fn, inputs, number):
+    total = timeit.timeit(lambda: [fn(i) for i in inputs], number=number)
+    per_call = total / number / len(inputs)
+    print(f"{label:>12}: {per_call * 1e6:8.3f} µs per call")
+    return per_call
+
+
+def bench_normalize():
+    compiled = departures.normalize_station_name.__wrapped__
+    memoized = departures.normalize_station_name
+
+    for name in DIRECTIONS:
+        assert normalize_with_re_sub(name) == memoized(name), name
+
+    print("normalize_station_name")
+    return {
+        "normalize.re_sub": report("re.sub", normalize_with_re_sub, DIRECTIONS, 2000),
+        "normalize.compiled": report("compiled", compiled, DIRECTIONS, 2000),
+        "normalize.memoized": report("memoized", memoized, DIRECTIONS, 2000),
+    }
+
+
+# Runs in a fresh interpreter so that nothing is imported or cached yet.
+# The first frame is the "Initializing ..." screen, measured from the start
+# of the process until it would be handed to the display.
+STARTUP_SCRIPT = """
+import json
+import time
+start = time.perf_counter()
+
+import flur
+import backends
+imported = time.perf_counter()
+
+
+class Stopwatch(backends.Sink):
+    def show(self, image, frame, boxes):
+        self.shown = time.perf_counter()
+
+
+class HeadlessApp(flur.App):
+    def start_sources(self):
+        pass
+
+
+backend = Stopwatch()
+HeadlessApp(backend)
+print(json.dumps({"import": imported - start, "first_frame": backend.shown - start}))
+"""
+
+
+def bench_startup(runs=5):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=here,
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    imported = statistics.median(r["import"] for r in results)
+    first_frame = statistics.median(r["first_frame"] for r in results)
+
+    print(f"startup (median of {runs} runs)")
+    print(f"{'import':>12}: {imported * 1e3:8.1f} ms")
+    print(f"{'first frame':>12}: {first_frame * 1e3:8.1f} ms")
+    return {"startup.import": imported, "startup.first_frame": first_frame}
+
+
+# Fixtures are transport.rest responses stored per scenario as
+# fixtures/<scenario>/departures.json and journeys-<to>.json
+SCENARIOS = ["day", "ring", "night", "empty"]
+
+TIME_KEYS = {"when", "plannedWhen", "departure",
+             "plannedDeparture", "arrival", "plannedArrival"}
+
+
+def fixture_name(request):
+    if request.url.path.endswith("/departures"):
+        return "departures.json"
+
+    to = request.url.params.get("to") or request.url.params.get("to.address")
+    return "journeys-" + re.sub(r"[^\w.-]", "_", to) + ".json"
+
+
+# Moves every timestamp in a response by delta
+def shift_times(data, delta):
+    if isinstance(data, dict):
+        return {k: (datetime.fromisoformat(v) + delta).isoformat() if k in TIME_KEYS and v is not None
+                else shift_times(v, delta) for (k, v) in data.items()}
+    if isinstance(data, list):
+        return [shift_times(v, delta) for v in data]
+    return data
+
+
+# Answers requests with the responses recorded for a scenario, moved in time
+# so that they look like they were recorded just now. Queries without a
+# recorded response fail with 404, like a failed request would.
+class Replay:
+    def __init__(self, scenario, now):
+        self.responses = {}
+
+        directory = os.path.join(FIXTURES, scenario)
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name)) as f:
+                data = json.load(f)
+
+            recorded = datetime.fromtimestamp(
+                data["realtimeDataUpdatedAt"], timezone.utc)
+            self.responses[name] = json.dumps(
+                shift_times(data, now - recorded)).encode()
+
+    def __call__(self, request):
+        content = self.responses.get(fixture_name(request))
+        if content is None:
+            return httpx.Response(404)
+
+        return httpx.Response(200, content=content, headers={"Content-Type": "application/json"})
+
+
+# Passes requests on to transport.rest and stores every good response
+class Recorder(httpx.AsyncBaseTransport):
+    def __init__(self, directory):
+        self.directory = directory
+        self.transport = httpx.AsyncHTTPTransport(http2=departures.HTTP2)
+
+    async def handle_async_request(self, request):
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+
+        if response.status_code == 200:
+            with open(os.path.join(self.directory, fixture_name(request)), "wb") as f:
+                f.write(content)
+
+        headers = [(k, v) for (k, v) in response.headers.items()
+                   if k.lower() not in ("content-encoding", "content-length")]
+        return httpx.Response(response.status_code, headers=headers, content=content)
+
+
+async def record_fixtures(scenario):
+    directory = os.path.join(FIXTURES, scenario)
+    os.makedirs(directory, exist_ok=True)
+
+    retainer = departures.DepartureRetainer(pool=departures.RequestPool(
+        httpx.AsyncClient(transport=Recorder(directory))))
+    await retainer.update_departures()
+    await retainer.update_journeys()
+    await retainer.close()
+    print(f"Recorded {len(os.listdir(directory))} responses to {directory}")
+
+
+# Every run requests again instead of being answered from the pool's cache,
+# and is not held back by the rate limit
+def replay_retainer(scenario):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        Replay(scenario, datetime.now(timezone.utc))))
+    return departures.DepartureRetainer(pool=departures.RequestPool(
+        client, ttl=0, bucket=policy.TokenBucket(math.inf, math.inf)))
+
+
+class HeadlessApp(flur.App):
+    def start_sources(self):
+        self.board = departures.HOME
+        self.scheduler = scheduler.Scheduler()
+        self.scheduler.put("claim", "Weil wir Dich lieben")
+
+
+# Runs fetch -> process -> draw -> swap once and returns the duration of
+# each stage or, with memory, the peak of the Python heap during it. Pixel
+# data allocated by Pillow is not traced and only shows up in max rss.
+def run_pipeline(loop, retainer, app, memory=False):
+    results = {}
+
+    def stage(name, fn):
+        if memory:
+            tracemalloc.reset_peak()
+            (before, _) = tracemalloc.get_traced_memory()
+            fn()
+            results[name] = tracemalloc.get_traced_memory()[1] - before
+        else:
+            start = time.perf_counter()
+            fn()
+            results[name] = time.perf_counter() - start
+
+    async def update():
+        await asyncio.gather(retainer.update_departures(), retainer.update_journeys())
+
+    def fetch():
+        loop.run_until_complete(update())
+
+    # Countdowns and transfers are worked out from the clock in draw
+    def process():
+        app.scheduler.put(app.source("departures"), retainer.departures_snapshot())
+        app.scheduler.put(app.source("journeys"), retainer.journeys_snapshot())
+
+    def swap():
+        # Always push a whole frame, otherwise every run after the first
+        # would be skipped as unchanged
+        app.last_frame = None
+        app.swap()
+
+    stage("fetch", fetch)
+    stage("process", process)
+    stage("draw", app.render)
+    stage("swap", swap)
+    return results
+
+
+def bench_render(runs=10):
+    app = HeadlessApp(backends.Sink())
+    metrics = {}
+
+    for scenario in SCENARIOS:
+        loop = asyncio.new_event_loop()
+        retainer = replay_retainer(scenario)
+
+        timings = [run_pipeline(loop, retainer, app) for _ in range(runs)]
+
+        tracemalloc.start()
+        memory = run_pipeline(loop, retainer, app, memory=True)
+        tracemalloc.stop()
+
+        loop.run_until_complete(retainer.close())
+        loop.close()
+
+        print(f"render {scenario} (median of {runs} runs)")
+        for name in timings[0]:
+            duration = statistics.median(t[name] for t in timings)
+            metrics[f"render.{scenario}.{name}"] = duration
+            print(f"{name:>12}: {duration * 1e3:8.2f} ms {memory[name] / 1024:8.0f} KiB peak")
+
+    # ru_maxrss is in KiB on Linux
+    print(f"{'max rss':>12}: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:8d} KiB")
+    return metrics
+
+
+def render_frame(app, scenario):
+    loop = asyncio.new_event_loop()
+    retainer = replay_retainer(scenario)
+    run_pipeline(loop, retainer, app)
+    loop.run_until_complete(retainer.close())
+    loop.close()
+    return app.last_frame
+
+
+# The driver's getbuffer converts the 8 bit image to 1 bit again on every
+# full update, even though swap already has the dithered frame. Images in
+# portrait orientation are turned first.
+def getbuffer(image, width, height):
+    if image.size == (height, width):
+        image = image.rotate(90, expand=True)
+    return bytearray(image.convert("1").tobytes("raw"))
+
+
+# pack has to give the driver's bytes for landscape and portrait frames, and
+# their inverse with invert. Only for frames without grey: the driver dithers
+# after turning the image, while swap dithers before.
+def check_pack(image, frame, width, height):
+    assert getbuffer(image, width, height) == display.pack(frame, width, height)
+
+    portrait = frame.transpose(Image.Transpose.ROTATE_270)
+    assert portrait.size == (height, width)
+    assert getbuffer(portrait, width, height) == display.pack(portrait, width, height)
+
+    inverted = bytes(b ^ 0xFF for b in getbuffer(frame, width, height))
+    assert inverted == display.pack(frame, width, height, invert=True)
+    assert inverted == display.pack(portrait, width, height, invert=True)
+
+
+def bench_pack():
+    app = HeadlessApp(backends.Sink())
+    frame = render_frame(app, "day")
+    image = app.im
+    (width, height) = image.size
+    check_pack(image, frame, width, height)
+
+    print("panel buffer")
+    return {
+        "pack.getbuffer": report("getbuffer", lambda i: getbuffer(i, width, height), [image], 200),
+        "pack.frame": report("pack", lambda f: display.pack(f, width, height), [frame], 200),
+    }
+
+
+# Drives the emulated panel through full -> partial -> full updates and checks
+# that it shows every frame. Returns the emulated time each update takes.
+def bench_panel():
+    app = HeadlessApp(backends.Sink())
+    day = render_frame(app, "day")
+    night = render_frame(app, "night")
+
+    # A countdown that changed
+    changed = day.copy()
+    changed.paste(0, (704, 120, 760, 150))
+
+    panel = backends.EmulatedPanel()
+    panel.open(day.size)
+
+    metrics = {}
+    for (name, frame) in [("full", day), ("partial", changed), ("full_after_partial", night)]:
+        boxes = None if panel.frame is None else display.changed_boxes(panel.frame, frame)
+        elapsed = panel.epd.elapsed
+        panel.show(frame, frame, boxes)
+
+        assert panel.epd.panel.tobytes() == frame.tobytes(), f"{name} update garbled"
+        metrics[f"panel.{name}"] = panel.epd.elapsed - elapsed
+
+    assert panel.epd.updates == {"full": 3, "partial": 1}
+
+    print("emulated panel")
+    for (name, seconds) in metrics.items():
+        print(f"{name:>30}: {seconds:8.2f} s")
+    return metrics
+
+
+BENCHMARKS = {
+    "normalize": bench_normalize,
+    "startup": bench_startup,
+    "render": bench_render,
+    "pack": bench_pack,
+    "panel": bench_panel,
+}
+
+
+# Returns the metrics that got slower than the baseline allows
+def regressions(results, baseline, tolerance):
+    return [(name, baseline[name], value) for (name, value) in results.items()
+            if name in baseline and value > baseline[name] * (1 + tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the monitor. Fails if a metric is slower than the baseline.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--baseline", default="bench-baseline.json",
+                        help="file with the results to compare against")
+    parser.add_argument("--record", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline (default: 0.2)")
+    parser.add_argument("--record-fixtures", metavar="SCENARIO",
+                        help="record live transport.rest responses as a scenario for render")
+    args = parser.parse_args()
+
+    if args.record_fixtures is not None:
+        asyncio.run(record_fixtures(args.record_fixtures))
+        return
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        results.update(BENCHMARKS[name]())
+
+    if args.record:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        return
+
+    # Timings depend on the machine, so the baseline is recorded on it and
+    # not checked in. Without one there is nothing to gate on.
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, record one with --record", file=sys.stderr)
+        sys.exit(2)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    for name in results:
+        if name not in baseline:
+            print(f"No baseline for {name}, record one with --record", file=sys.stderr)
+
+    failed = regressions(results, baseline, args.tolerance)
+    for (name, before, after) in failed:
+        print(f"REGRESSION {name}: {before * 1e6:.1f} µs -> {after * 1e6:.1f} µs")
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
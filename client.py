@@ -0,0 +1,92 @@
+import argparse
+import logging
+import time
+
+from PIL import Image
+import requests
+
+import backends
+import display
+
+# Seconds to wait before asking again after the server could not be reached
+RETRY = 10
+
+
+# Shows the frames rendered by a flur instance running with --display=serve on
+# another display. Each request waits on the server until the frame changes,
+# so an idle client costs one request every wait seconds.
+class Client:
+    def __init__(self, url, backend, wait=60):
+        self.url = url.rstrip("/") + "/frame.epd"
+        self.backend = backend
+        self.wait = wait
+        self.session = requests.Session()
+        self.etag = None
+        self.frame = None
+
+    def poll(self):
+        headers = {} if self.etag is None else {"If-None-Match": self.etag}
+        try:
+            resp = self.session.get(self.url, params={"wait": self.wait},
+                                    headers=headers, timeout=self.wait + 10)
+        except requests.RequestException:
+            logging.warning(f"Failed to reach {self.url}")
+            time.sleep(RETRY)
+            return
+
+        if resp.status_code == 304:
+            return
+        if resp.status_code != 200:
+            logging.warning(f"Failed to fetch frame: HTTP {resp.status_code}")
+            time.sleep(RETRY)
+            return
+
+        size = tuple(int(v) for v in resp.headers["X-Frame-Size"].split("x"))
+        frame = Image.frombytes("1", size, resp.content)
+
+        if self.frame is None:
+            self.backend.open(size)
+            boxes = None
+        else:
+            boxes = display.changed_boxes(self.frame, frame)
+
+        logging.info("Showing new frame")
+        self.backend.show(frame, frame, boxes)
+        self.frame = frame
+        self.etag = resp.headers.get("ETag")
+
+    def run(self):
+        # The display is only opened with the first frame, when its size is
+        # known
+        while self.frame is None:
+            self.poll()
+
+        self.backend.run(self.poll, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shows the frames served by flur.py --display=serve")
+    parser.add_argument("url", help="address of the server, e.g. http://flur:8080")
+    parser.add_argument("--display", default="epd",
+                        help="display backend, see backends.BACKENDS (default: epd)")
+    parser.add_argument("--wait", type=int, default=60,
+                        help="seconds the server may hold a request (default: 60)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)-8s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    backend = backends.create(args.display)
+    try:
+        Client(args.url, backend, args.wait).run()
+
+    except Exception:
+        logging.exception("Fatal exception")
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,133 @@
 from datetime import datetime
+from math import ceil
 import asyncio
+import functools
+import importlib.util
 import logging
 import random
 import re
+import time
 
-from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
+import httpx
 import pytz
-import requests
 
+import metrics
+import policy
+import store
 
+# HTTP/2 needs the optional h2 package (httpx[http2])
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+# transport.rest payloads are turned into these records once when they
+# arrive, with all timestamps already parsed
+class Departure(NamedTuple):
+    line: str
+    product: str
+    direction: str
+    when: datetime
+
+
+class Leg(NamedTuple):
+    departure: datetime
+    arrival: datetime
+    destination: str
+    direction: str
+    line: str
+    product: str
+    walking: bool
+
+
+class Connection(NamedTuple):
+    destination: str
+    line: str
+    arrival: datetime
+    departure: datetime
+    stopover: str
+    change_station: str
+    product: str
+
+
+class Route(NamedTuple):
+    product: str
+    line: str
+    departures: tuple
+    destination: str = None
+    connections: tuple = ()
+
+
+# transport.rest always sends ISO 8601, so only fall back to dateutil for
+# anything fromisoformat does not understand
+def parse_time(value):
+    if value is None:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
+def parse_departures(payload):
+    return tuple(Departure(
+        d["line"]["name"],
+        d["line"]["product"],
+        d["direction"],
+        parse_time(d["when"])
+    ) for d in payload)
+
+
+def parse_leg(leg):
+    line = leg.get("line") or {}
+    return Leg(
+        parse_time(leg["departure"] or leg["plannedDeparture"]),
+        parse_time(leg["arrival"] or leg["plannedArrival"]),
+        leg["destination"]["name"],
+        leg.get("direction"),
+        line.get("name"),
+        line.get("product"),
+        leg.get("walking", False)
+    )
+
+
+# Returns a tuple of journeys, each of which is a tuple of legs
+def parse_journeys(payload):
+    return tuple(tuple(parse_leg(leg) for leg in journey["legs"]) for journey in payload)
+
+
+# Applied in order, so later rules see the result of earlier ones
+STATION_RULES = [(re.compile(pattern), repl) for (pattern, repl) in [
+    (r"^(U|S)(\+U)? ", ""),
+    (r"^Alt-", ""),
+    (r"(,|(\s->)) .*$", ""),
+    (r"/\s?\w+$", ""),
+    (r"\sHauptbahnhof$", ""),
+    (r"\sHbf\.?$", ""),
+    (r"\sStr((\.)|aße)$", " Str."),
+    (r"^Friedrich-Ludwig-Jahn-Sportpark", "Friedr.-L.-Jahn-Sportp."),
+    (r"^Rathaus ", ""),
+    (r"^Betriebshof ", "BVG-Hof "),
+    (r"Terminal", "T"),
+    (r"^Kurt-Schumacher-Platz", "Kutschi"),
+    (r"\s?\(Berlin\)$", ""),
+]]
+
+
+# Only a handful of directions are served at one stop, so remember them
+@functools.lru_cache(maxsize=512)
 def normalize_station_name(name):
-    name = re.sub(r"^(U|S)(\+U)? ", "", name)
-    name = re.sub(r"^Alt-", "", name)
-    name = re.sub(r"(,|(\s->)) .*$", "", name)
-    name = re.sub(r"/\s?\w+$", "", name)
-    name = re.sub(r"\sHauptbahnhof$", "", name)
-    name = re.sub(r"\sHbf\.?$", "", name)
-    name = re.sub(r"\sStr((\.)|aße)$", " Str.", name)
-    name = re.sub(r"^Friedrich-Ludwig-Jahn-Sportpark",
-                  "Friedr.-L.-Jahn-Sportp.", name)
-    name = re.sub(r"^Rathaus ", "", name)
-    name = re.sub(r"^Betriebshof ", "BVG-Hof ", name)
-    name = re.sub(r"Terminal", "T", name)
-    name = re.sub(r"^Kurt-Schumacher-Platz", "Kutschi", name)
-    name = re.sub(r"\s?\(Berlin\)$", "", name)
+    for (pattern, repl) in STATION_RULES:
+        name = pattern.sub(repl, name)
     return name
 
 
 def group_by_direction(departures):
     by_direction = {}
     for departure in departures:
-        dirct = normalize_station_name(departure["direction"])
+        dirct = normalize_station_name(departure.direction)
 
         if dirct in by_direction:
             by_direction[dirct].append(departure)
@@ -41,10 +136,14 @@ def group_by_direction(departures):
     return by_direction
 
 
+# Departures up to this many minutes away are shown as a countdown, later
+# ones with their time
+COUNTDOWN_MINUTES = 25
+
+
 def dept_to_str(departure, now):
-    mmax = relativedelta(minutes=25)
+    mmax = relativedelta(minutes=COUNTDOWN_MINUTES)
     mmin = relativedelta(seconds=60)
-    departure = parser.parse(departure)
     if departure <= now+mmin:
         return "jetzt"
     elif departure <= now+mmax:
@@ -87,80 +186,257 @@ terminus_south = ["Mariendorf", "Seestraße", "Wedding", "Naturkundemuseum",
                   "Hallesches Tor", "Mehringdamm", "Platz der Luftbrücke", "Tempelhof"]
 
 
-def fetch(session, url, timeout, default=None):
-    try:
-        response = session.get(url, timeout=timeout)
-    except requests.exceptions.ReadTimeout:
-        logging.warn("Failed to fetch due to timeout")
-        return default
+# Where a connection is shown to: a stop id or an address given as
+# (latitude, longitude, name), and which products may be used to get there
+class Target(NamedTuple):
+    stop: str = None
+    address: tuple = None
+    suburban: bool = False
+    tram: bool = False
+    bus: bool = False
+    transfers: int = 1
+
+
+# What one display shows: the departures from stops (merged), one line in each
+# direction identified by the termini, with the connections for inbound
+# targets under the southbound line and for outbound targets under the
+# northbound one. Journeys start at the first stop.
+class Board(NamedTuple):
+    stops: tuple
+    terminus_south: tuple
+    terminus_north: tuple
+    inbound: tuple = ()
+    outbound: tuple = ()
+
+
+HOME = Board(
+    stops=(home_id,),
+    terminus_south=tuple(terminus_south),
+    terminus_north=tuple(terminus_north),
+    inbound=(
+        Target(westend_id, suburban=True),
+        Target(prenzlauer_id, suburban=True),
+        Target(anton_id, tram=True),
+        Target(hansaplatz_id),
+        Target(address=(anklamer_lat, anklamer_lng, anklamer_addr), tram=True),
+        Target(frator_id),
+        Target(moritz_id, bus=True),
+    ),
+    outbound=(
+        Target(bekassinenweg_id, bus=True),
+    ))
+
+# Selected with flur.py --board=<name>
+BOARDS = {
+    "home": HOME,
+}
+
+
+# transport.rest returns the next 10 minutes of departures unless asked for
+# more
+DURATION = 10
+
+
+# Minutes of departures to ask for when they are only fetched every poll
+# seconds, so the board still has countdowns just before the next fetch
+def departures_duration(poll):
+    return max(DURATION, ceil(poll / 60) + COUNTDOWN_MINUTES)
+
+
+def departures_url(stop, duration=DURATION):
+    return f"https://v6.bvg.transport.rest/stops/{stop}/departures?language=de&duration={duration}"
+
+
+def journeys_url(origin, target):
+    if target.address is None:
+        to = f"to={target.stop}"
+    else:
+        (lat, lng, name) = target.address
+        to = f"to.latitude={lat}&to.longitude={lng}&to.address={name}"
 
-    if response.status_code == 200:
-        return response.json()
+    query = f"https://v6.bvg.transport.rest/journeys?from={origin}&{to}&transfers={target.transfers}&startWithWalking=false&results=2&ferry=false&express=false&regional=false"
 
-    return default
+    if not target.suburban:
+        query += "&suburban=false"
 
+    if not target.tram:
+        query += "&tram=false"
 
-def get_data(session=None):
-    try:
-        if session != None:
-            response = session.get(
-                f"https://v6.bvg.transport.rest/stops/{home_id}/departures?language=de", timeout=6.1)
-        else:
-            response = requests.get(
-                f"https://v6.bvg.transport.rest/stops/{home_id}/departures?language=de", timeout=6.1)
-    except requests.exceptions.ReadTimeout:
-        logging.warn("Failed to fetch departures due to timeout")
-        return None
+    if not target.bus:
+        query += "&bus=false"
 
-    if response.status_code == 200:
-        return response.json()
+    return query
 
-    return None
 
+def open_client():
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        limits=httpx.Limits(max_connections=10,
+                            max_keepalive_connections=10, keepalive_expiry=120),
+        timeout=10)
 
-def get_change_time(session, destination, allow_suburban, allow_tram, allow_bus, transfers=1):
-    query = f"https://v6.bvg.transport.rest/journeys?from={home_id}&to={destination}&transfers={transfers}&startWithWalking=false&results=2&ferry=false&express=false&regional=false"
 
-    if not allow_suburban:
-        query += "&suburban=false"
+# transport.rest allows 100 requests per minute, stay well below that
+RATE = 1
+BURST = 20
 
-    if not allow_tram:
-        query += "&tram=false"
+# Ask for the departures a second time if the first request takes this long
+HEDGE_AFTER = 1.5
 
-    if not allow_bus:
-        query += "&bus=false"
 
-    return fetch(session, query, 3.1)
+# Returns the decoded response or default, see policy.Endpoint.get
+async def fetch(client, endpoint, url, timeout, default=None, hedge_after=None):
+    response = await endpoint.get(client, url, timeout, hedge_after)
+    if response is None or response.status_code != 200:
+        return default
 
+    try:
+        return response.json()
+    except ValueError:
+        logging.warning(f"Invalid response from {endpoint.name}")
+        return default
 
-def get_change_time_home(session, lat, long, name, allow_suburban, allow_tram, allow_bus):
-    query = f"https://v6.bvg.transport.rest/journeys?from={home_id}&to.latitude={lat}&to.longitude={long}&to.address={name}&transfers=1&startWithWalking=false&results=2&ferry=false&express=false&regional=false"
 
-    if not allow_suburban:
-        query += "&suburban=false"
+# Shared by every retainer in the process, i.e. by all boards that flur.py
+# draws. Requests for the same URL that overlap wait for a single request,
+# and its parsed result is reused for ttl seconds, so boards watching the
+# same stop or journey only cost one request. With a store.Store, responses
+# are also written to disk, where other processes pick them up while they
+# are fresh and the next start finds them. Only requests are coalesced
+# within the process: once the stored entry is stale, each process sends
+# its own.
+class RequestPool:
+    def __init__(self, client=None, ttl=30, bucket=None, store=None):
+        self.client = client
+        self.ttl = ttl
+        self.store = store
+        self.in_flight = {}
+        self.results = {}
+
+        bucket = bucket or policy.TokenBucket(RATE, BURST)
+        self.endpoints = {
+            "departures": policy.Endpoint("departures", bucket),
+            "journeys": policy.Endpoint("journeys", bucket),
+        }
+
+    def get_client(self):
+        if self.client is None:
+            self.client = open_client()
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # Counters and circuit breaker state per endpoint
+    def stats(self):
+        return {name: endpoint.stats() for (name, endpoint) in self.endpoints.items()}
+
+    # Returns parse(json) or None if the request failed. Failures are not
+    # cached.
+    async def get(self, endpoint, url, timeout, parse, hedge_after=None):
+        if url in self.results:
+            (fetched_at, result) = self.results[url]
+            if time.monotonic() - fetched_at < self.ttl:
+                return result
+
+        if self.store is not None:
+            entry = self.store.get(url)
+            if entry is not None and entry.is_fresh():
+                result = parse_stored(url, entry.value, parse)
+                if result is not None:
+                    return result
+
+        if url not in self.in_flight:
+            self.in_flight[url] = asyncio.ensure_future(
+                self.request(endpoint, url, timeout, parse, hedge_after))
+
+        # One caller being cancelled must not cancel the request for the others
+        return await asyncio.shield(self.in_flight[url])
+
+    async def request(self, endpoint, url, timeout, parse, hedge_after):
+        try:
+            data = await fetch(self.get_client(), self.endpoints[endpoint],
+                               url, timeout, hedge_after=hedge_after)
+        finally:
+            del self.in_flight[url]
+
+        if data is None:
+            return None
+
+        result = parse(data)
+        self.results[url] = (time.monotonic(), result)
+        if self.store is not None:
+            self.store.put(url, data, self.ttl)
+        return result
+
+    # The last result for url, however old, or None
+    def stored(self, url, parse):
+        if self.store is None:
+            return None
+
+        entry = self.store.get(url)
+        return None if entry is None else parse_stored(url, entry.value, parse)
+
+    async def departures(self, stop, duration=DURATION):
+        return await self.get("departures", departures_url(stop, duration), 6.1,
+                              departures_response, HEDGE_AFTER)
+
+    async def journeys(self, origin, target):
+        return await self.get("journeys", journeys_url(origin, target), 3.1,
+                              journeys_response)
+
+
+def departures_response(data):
+    return parse_departures(data["departures"])
+
+
+def journeys_response(data):
+    return parse_journeys(data["journeys"])
+
+
+# The store keeps the responses as they came, which may be from an older
+# version or written by another process
+def parse_stored(url, data, parse):
+    try:
+        return parse(data)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        logging.warning(f"Ignoring invalid stored response for {url}")
+        return None
 
-    if not allow_tram:
-        query += "&tram=false"
 
-    if not allow_bus:
-        query += "&bus=false"
+pool = None
 
-    return fetch(session, query, 3.1)
 
+def shared_pool():
+    global pool
+    if pool is None:
+        pool = RequestPool(store=store.shared())
+    return pool
 
-def process_change_time(response):
-    legs = None
-    for journey in response["journeys"]:
-        if parser.parse(get_departure(journey["legs"][0])) > datetime.now(pytz.utc) + relativedelta(seconds=30):
-            legs = journey["legs"]
-            break
 
+# The journey to show is the first one that can still be caught
+def next_journey(journeys, now):
+    for journey in journeys:
+        if journey[0].departure > now + relativedelta(seconds=30):
+            return journey
+
+    return None
+
+
+# The transfer of the next journey that can still be caught at now. Once
+# the first leg of a journey has left, the next one is shown with its own
+# margin, so this is recomputed from the clock and not only after a fetch.
+@metrics.timed("process_change_time")
+def process_change_time(journeys, now):
+    legs = next_journey(journeys, now)
     if legs == None:
         return None
 
     next_leg = 1
     for i in range(1, len(legs)):
-        if "walking" in legs[i] and legs[i]["walking"]:
+        if legs[i].walking:
             next_leg = i+1
         else:
             break
@@ -168,53 +444,49 @@ def process_change_time(response):
     if next_leg >= len(legs):
         return None
 
-    arrival = parser.parse(get_arrival(legs[0]))
-    change_station = normalize_station_name(legs[0]["destination"]["name"])
-    departure = parser.parse(get_departure(legs[next_leg]))
-    line = legs[next_leg]["line"]["name"]
+    arrival = legs[0].arrival
+    change_station = normalize_station_name(legs[0].destination)
+    departure = legs[next_leg].departure
+    line = legs[next_leg].line
 
     if line == "S41" or line == "S42":
         destination = "Ring"
     else:
-        destination = normalize_station_name(legs[next_leg]["direction"])
+        destination = normalize_station_name(legs[next_leg].direction)
 
     delta = delta_to_str(relativedelta(departure, arrival))
     if delta == "ewig":
         return None
 
-    return {
-        "destination": destination,
-        "line": line,
-        "arrival": arrival,
-        "departure": departure,
-        "stopover": delta,
-        "change_station": change_station,
-        "product": legs[next_leg]["line"]["product"]
-    }
-
-
-def get_departure(leg):
-    return leg["departure"] or leg["plannedDeparture"]
+    return Connection(destination, line, arrival, departure, delta, change_station, legs[next_leg].product)
 
 
-def get_arrival(leg):
-    return leg["arrival"] or leg["plannedArrival"]
+# More departures than these don't fit next to the destination: at most
+# three per direction, and after the first only those in the next 10
+# minutes, like the board showed before it was fetched for longer
+DEPARTURES_SHOWN = 3
+DEPARTURES_SHOWN_MINUTES = DURATION
 
 
-def process_departures(departures):
+# Countdowns for the next departures still to come at now, by direction
+@metrics.timed("process_departures")
+def process_departures(departures, now):
     if departures is None:
         return {}
 
     subways = group_by_direction(
-        [departure for departure in departures if departure["line"]["product"] == "subway"])
+        [departure for departure in departures if departure.product == "subway"])
     busses = group_by_direction(
-        [departure for departure in departures if departure["line"]["product"] == "bus"])
+        [departure for departure in departures if departure.product == "bus"])
 
-    now = datetime.now(pytz.utc)
-    results = {k: {"product": "subway", "line": v[0]["line"]["name"], "departures": [dept_to_str(
-        train["when"], now) for train in v if parser.parse(train["when"]) > now]} for (k, v) in subways.items()}
-    busses = {k: {"product": "bus", "line": v[0]["line"]["name"], "departures": [dept_to_str(
-        train["when"], now) for train in v if parser.parse(train["when"]) > now]} for (k, v) in busses.items()}
+    def countdowns(trains):
+        upcoming = [train.when for train in trains if train.when is not None and train.when > now]
+        horizon = now + relativedelta(minutes=DEPARTURES_SHOWN_MINUTES)
+        shown = upcoming[:1] + [when for when in upcoming[1:DEPARTURES_SHOWN] if when <= horizon]
+        return tuple(dept_to_str(when, now) for when in shown)
+
+    results = {k: Route("subway", v[0].line, countdowns(v)) for (k, v) in subways.items()}
+    busses = {k: Route("bus", v[0].line, countdowns(v)) for (k, v) in busses.items()}
 
     if len(results) < 2:
         for (k, v) in busses.items():
@@ -224,118 +496,175 @@ def process_departures(departures):
     return results
 
 
+# A journey result stays good until its first leg has left, but is asked for
+# again after this many seconds to pick up delays
+JOURNEY_MAX_AGE = 5 * 60
+
+
+# Returns when the journeys fetched at now should be queried again. Tight
+# transfers are always queried again, since a small delay decides whether
+# they still work.
+def journeys_expiry(journeys, now):
+    journey = next_journey(journeys, now)
+    if journey is None:
+        return now
+
+    connection = process_change_time(journeys, now)
+    if connection is not None and connection.stopover == "knapp":
+        return now
+
+    return min(journey[0].departure - relativedelta(seconds=30),
+               now + relativedelta(seconds=JOURNEY_MAX_AGE))
+
+
+class Connections(NamedTuple):
+    inbound: tuple
+    outbound: tuple
+
+
+# Fetches departures and journeys for a board and keeps the last good
+# responses. The fetch_* coroutines return immutable snapshots for the
+# scheduler. They hold absolute times only, everything relative to the
+# clock is derived by get_display_data when a frame is drawn. duration is
+# how many minutes of departures are fetched.
 class DepartureRetainer():
-    def __init__(self):
-        self.last_refresh = datetime.now(pytz.utc) - relativedelta(hours=24)
-        self.departures_raw = []
-        self.subway_departures = {}
-        self.inbound_connections_raw = [None] * 7
-        self.inbound_connections = []
-        self.outbound_connections_raw = [None] * 1
-        self.outbound_connections = []
-
-    async def refresh_data(self):
+    def __init__(self, board=HOME, pool=None, duration=DURATION):
+        self.board = board
+        self.pool = pool or shared_pool()
+        self.duration = duration
+        self.inbound_expiry = [None] * len(board.inbound)
+        self.outbound_expiry = [None] * len(board.outbound)
+        self.warm_start()
+
+    # Start from the responses stored by an earlier run. Departures that have
+    # left and journeys that can't be caught anymore are dropped when a frame
+    # is drawn, and the journeys are queried again on the first update.
+    def warm_start(self):
+        origin = self.board.stops[0]
+        self.departures_raw = [self.pool.stored(departures_url(stop, self.duration),
+                                                departures_response)
+                               for stop in self.board.stops]
+        self.inbound_connections_raw = [self.pool.stored(journeys_url(origin, target),
+                                                         journeys_response)
+                                        for target in self.board.inbound]
+        self.outbound_connections_raw = [self.pool.stored(journeys_url(origin, target),
+                                                          journeys_response)
+                                         for target in self.board.outbound]
+
+    # The pool opens a new client when it is used again
+    async def close(self):
+        await self.pool.close()
+
+    async def fetch_departures(self):
+        await self.update_departures()
+        return self.departures_snapshot()
+
+    async def fetch_journeys(self):
+        await self.update_journeys()
+        return self.journeys_snapshot()
+
+    async def update_departures(self):
+        logging.info("Fetching departures")
+
+        responses = await asyncio.gather(
+            *[self.pool.departures(stop, self.duration) for stop in self.board.stops])
+
+        for (i, data) in enumerate(responses):
+            if data is not None:
+                self.departures_raw[i] = data
+
+    async def update_journeys(self):
+        now = datetime.now(pytz.utc)
+        origin = self.board.stops[0]
+
+        # Only targets whose last result has expired are queried
+        queries = [(raw, expiry, i, target)
+                   for (raw, expiry, targets) in [
+                       (self.inbound_connections_raw, self.inbound_expiry, self.board.inbound),
+                       (self.outbound_connections_raw, self.outbound_expiry, self.board.outbound)]
+                   for (i, target) in enumerate(targets)
+                   if expiry[i] is None or expiry[i] <= now]
+
+        logging.info(f"Fetching journeys for {len(queries)} of "
+                     f"{len(self.board.inbound) + len(self.board.outbound)} targets")
+
+        async def query(raw, expiry, i, target):
+            data = await self.pool.journeys(origin, target)
+            if data is not None:
+                raw[i] = data
+                expiry[i] = journeys_expiry(data, now)
+
+        await asyncio.gather(*[query(*q) for q in queries])
+
+    # The snapshots are made from the last good responses: the departures of
+    # all stops as one tuple, and the journeys to each target
+    def departures_snapshot(self):
+        stops = [x for x in self.departures_raw if x is not None]
+        if len(stops) == 0:
+            return None
+
+        if len(stops) == 1:
+            return tuple(stops[0])
+        return tuple(sorted((d for stop in stops for d in stop),
+                            key=lambda d: (d.when is None, d.when)))
+
+    def journeys_snapshot(self):
+        return Connections(
+            tuple(x for x in self.inbound_connections_raw if x is not None),
+            tuple(x for x in self.outbound_connections_raw if x is not None))
+
+
+# Builds the board from the latest snapshots without touching the network.
+# Countdowns, departed trains and transfers are worked out for now, so the
+# board stays right between fetches.
+def get_display_data(departures, journeys, board=HOME, now=None):
+    if now is None:
         now = datetime.now(pytz.utc)
-        if now - relativedelta(seconds=50) < self.last_refresh and len(self.departures_raw) > 0:
-            return
 
-        logging.info("Fetching departures")
+    subway_departures = process_departures(departures, now)
+    if journeys is None:
+        connections = Connections((), ())
+    else:
+        connections = Connections(
+            tuple(process_change_time(x, now) for x in journeys.inbound),
+            tuple(process_change_time(x, now) for x in journeys.outbound))
+
+    result = []
+    night = False
+
+    for terminus in board.terminus_south:
+        if terminus in subway_departures:
+            route = subway_departures[terminus]
+
+            if route.line == "N6":
+                route = route._replace(destination=terminus, connections=())
+                night = True
+            else:
+                route = route._replace(
+                    destination=terminus, connections=connections.inbound)
+
+            result.append(route)
+            break
+
+    for terminus in board.terminus_north:
+        if terminus in subway_departures:
+            route = subway_departures[terminus]
+
+            if route.line == "N6":
+                night = True
+
+            result.append(route._replace(
+                destination=terminus, connections=connections.outbound))
+            break
+
+    if len(result) == 0:
+        logging.info("No departures")
+        night = True
+
+    if night:
+        result.reverse()
 
-        with requests.Session() as session:
-            departures = get_data(session=session)
-            if departures is not None:
-                self.departures_raw = departures
-
-            self.subway_departures = process_departures(
-                self.departures_raw['departures'])
-
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                loop = asyncio.get_event_loop()
-                connections = [
-                    asyncio.gather(*[
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, westend_id, True, False, False)),
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, prenzlauer_id, True, False, False)),
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, anton_id, False, True, False)),
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, hansaplatz_id, False, False, False)),
-                        loop.run_in_executor(executor, get_change_time_home, *(
-                            session, anklamer_lat, anklamer_lng, anklamer_addr, False, True, False)),
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, frator_id, False, False, False)),
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, moritz_id, False, False, True)),
-                    ]), asyncio.gather(*[
-                        loop.run_in_executor(
-                            executor, get_change_time, *(session, bekassinenweg_id, False, False, True)),
-                    ])
-                ]
-
-                response = await asyncio.gather(*connections)
-                logging.info("Processing departures")
-
-                inbound = response[0]
-                outbound = response[1]
-
-                for (i, data) in enumerate(inbound):
-                    if data is not None:
-                        self.inbound_connections_raw[i] = data
-
-                self.inbound_connections = [process_change_time(
-                    x) for x in self.inbound_connections_raw if x is not None]
-
-                for (i, data) in enumerate(outbound):
-                    if data is not None:
-                        self.outbound_connections_raw[i] = data
-
-                self.outbound_connections = [process_change_time(
-                    x) for x in self.outbound_connections_raw if x is not None]
-
-        self.last_refresh = now
-
-    def get_display_data(self):
-        loop = asyncio.get_event_loop()
-        future = asyncio.ensure_future(self.refresh_data())
-        loop.run_until_complete(future)
-        result = []
-        night = False
-
-        for terminus in terminus_south:
-            if terminus in self.subway_departures:
-                route = self.subway_departures[terminus]
-                route["destination"] = terminus
-
-                if route["line"] == "N6":
-                    route["connections"] = []
-                    night = True
-                else:
-                    route["connections"] = self.inbound_connections
-
-                result.append(route)
-                break
-
-        for terminus in terminus_north:
-            if terminus in self.subway_departures:
-                route = self.subway_departures[terminus]
-                route["destination"] = terminus
-
-                if route["line"] == "N6":
-                    night = True
-
-                route["connections"] = self.outbound_connections
-                result.append(route)
-                break
-
-        if len(result) == 0:
-            logging.info("No departures")
-            night = True
-
-        if night:
-            result.reverse()
-
-        return result, night
+    return result, night
 
 
 def bvg_claim():
@@ -355,9 +684,9 @@ def bvg_claim():
     else:
         return f"Weil wir {complete[random.randrange(0, len(complete))]}"
 
-# print(process_departures(get_data()))
-# print(process_change_time(get_change_time(hansaplatz_id, False, False, False)))
-# print(process_change_time(get_change_time_home(anklamer_lat, anklamer_lng, anklamer_addr, False, True, False)))
+# now = datetime.now(pytz.utc)
+# print(process_departures(asyncio.run(RequestPool().departures(home_id)), now))
+# print(process_change_time(asyncio.run(RequestPool().journeys(home_id, HOME.inbound[0])), now))
 
 # depts = DepartureRetainer()
-# print(depts.get_display_data())
+# print(get_display_data(asyncio.run(depts.fetch_departures()), None))
@@ -0,0 +1,145 @@
+from PIL import Image, ImageChops
+
+# Rows that are compared together when looking for changed regions
+BAND_HEIGHT = 16
+
+# Use a partial update if at most this share of the panel changed
+PARTIAL_MAX_AREA = 0.25
+
+# Force a full refresh after this many partial updates to clear ghosting
+FULL_REFRESH_EVERY = 20
+
+
+def area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+# Both frames must be mode 1 images of the same size. Returns a list of
+# (left, top, right, bottom) boxes covering every changed pixel.
+def changed_boxes(old, new):
+    diff = ImageChops.logical_xor(old, new)
+    bbox = diff.getbbox()
+    if bbox is None:
+        return []
+
+    boxes = []
+    for top in range(bbox[1], bbox[3], BAND_HEIGHT):
+        bottom = min(top + BAND_HEIGHT, bbox[3])
+        band = diff.crop((0, top, diff.width, bottom)).getbbox()
+        if band is None:
+            continue
+
+        box = (band[0], top + band[1], band[2], top + band[3])
+
+        # Merge with the previous box if they touch and merging does not
+        # add a lot of unchanged area (e.g. countdowns in two columns)
+        if len(boxes) > 0 and boxes[-1][3] >= box[1]:
+            merged = union(boxes[-1], box)
+            if area(merged) <= (area(boxes[-1]) + area(box)) * 1.5:
+                boxes[-1] = merged
+                continue
+
+        boxes.append(box)
+
+    return boxes
+
+
+def use_partial(boxes, size):
+    return sum(area(b) for b in boxes) <= size[0] * size[1] * PARTIAL_MAX_AREA
+
+
+# Packs a mode 1 frame the way epd.getbuffer() does: 8 pixels per byte, most
+# significant bit first, row by row, a set bit for white. The frame is already
+# dithered, so this is a single bulk copy instead of another conversion.
+# Frames in portrait orientation are turned like the driver does, panels that
+# use a set bit for black need invert. The frame must be bilevel: the driver
+# dithers after turning, so for grey portrait images its bytes differ.
+def pack(frame, width, height, invert=False):
+    if frame.size == (height, width) and width != height:
+        frame = frame.transpose(Image.Transpose.ROTATE_90)
+
+    return frame.tobytes("raw", "1;I" if invert else "1")
+
+
+# The 7.5" HD panel (SSD1677) addresses X in pixels and writes whole bytes,
+# so windows have to start and end on a multiple of eight.
+def align_box(box, width):
+    left = box[0] - box[0] % 8
+    right = min(width, box[2] + (-box[2]) % 8)
+    return (left, box[1], right, box[3])
+
+
+# The driver sets up the Y window from 0x2AF down to 0 in decrementing mode
+# and starts each frame at row 0, so the counter wraps after the first row.
+def ram_row(y):
+    if y == 0:
+        return 0
+    return 0x2B0 - y
+
+
+def window_fits(box):
+    return box[1] > 0
+
+
+def write_window(epd, ram, frame, box):
+    left, top, right, bottom = box
+    start, end = ram_row(top), ram_row(bottom - 1)
+    last = right - 1
+
+    epd.send_command(0x44)
+    epd.send_data2([left & 0xFF, left >> 8, last & 0xFF, last >> 8])
+    epd.send_command(0x45)
+    epd.send_data2([start & 0xFF, start >> 8, end & 0xFF, end >> 8])
+    epd.send_command(0x4E)
+    epd.send_data2([left & 0xFF, left >> 8])
+    epd.send_command(0x4F)
+    epd.send_data2([start & 0xFF, start >> 8])
+
+    epd.send_command(ram)
+    epd.send_data2(frame.crop(box).tobytes("raw"))
+
+
+# Back to the whole panel for the driver's full updates. epd.display() only
+# resets the Y counter, so X has to be put back to the left edge here.
+def reset_window(epd):
+    epd.send_command(0x44)
+    epd.send_data2([0x00, 0x00, 0x6F, 0x03])
+    epd.send_command(0x45)
+    epd.send_data2([0xAF, 0x02, 0x00, 0x00])
+    epd.send_command(0x4E)
+    epd.send_data2([0x00, 0x00])
+    epd.send_command(0x4F)
+    epd.send_data2([0x00, 0x00])
+
+
+# Keep the "previous image" RAM in sync with what is on the panel, the
+# differential waveform compares it against the new image
+def sync_previous(epd, buffer):
+    epd.send_command(0x4E)
+    epd.send_data2([0x00, 0x00])
+    epd.send_command(0x4F)
+    epd.send_data2([0x00, 0x00])
+    epd.send_command(0x26)
+    epd.send_data2(buffer)
+
+
+def display_partial(epd, old, new, boxes):
+    boxes = [align_box(b, new.width) for b in boxes]
+
+    for box in boxes:
+        write_window(epd, 0x26, old, box)
+        write_window(epd, 0x24, new, box)
+
+    epd.send_command(0x22)
+    epd.send_data(0xFF)  # Display mode 2, differential update
+    epd.send_command(0x20)
+    epd.ReadBusy()
+
+    for box in boxes:
+        write_window(epd, 0x26, new, box)
+
+    reset_window(epd)
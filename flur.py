@@ -1,107 +1,200 @@
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 from math import ceil
-from random import random
-from time import sleep
+from random import Random
 import sys
 import locale
 import logging
-import typst
+import threading
 
-from astral.sun import sun
-from PIL import Image, ImageDraw, ImageTk, ImageFont
+from PIL import Image, ImageDraw, ImageOps
 import pytz
 
-import departures
-# import wetter
-import astro
+import assets
+import backends
+import display
+import metrics
+from lazy import lazy_import
+
+# None of these are needed for the first frame, so they are only loaded
+# once they are used
+departures = lazy_import("departures")
+typst = lazy_import("typst")
+astro = lazy_import("astro")
+scheduler = lazy_import("scheduler")
+wetter = lazy_import("wetter")
+
+
+# Value of a --name=value argument
+def option(name, default):
+    prefix = f"--{name}="
+    return next((a[len(prefix):] for a in sys.argv if a.startswith(prefix)), default)
+
 
 DEBUG = "--debug" in sys.argv
+# --display=<backend>, see backends.BACKENDS. --debug is short for --display=tk
+DISPLAY = option("display", "tk" if DEBUG else "epd")
+# --board=<name>, see departures.BOARDS. Several boards can be drawn by one
+# process, sharing their requests, with one display each:
+# --board=home,office --display=serve:8080,serve:8081
+BOARD = option("board", "home")
+# --metrics=<port> serves Prometheus metrics over HTTP, --metrics-file=<path>
+# writes them for node_exporter's textfile collector after every frame
+METRICS_PORT = option("metrics", None)
+METRICS_FILE = option("metrics-file", None)
+FORECAST = "--forecast" in sys.argv
 REFRESH = 5 if DEBUG else 30
+# --tick redraws right after every full minute, when the countdowns change.
+# They are worked out from the clock, so departures only need to be fetched
+# to pick up delays, every --poll=<seconds>. Each fetch then asks for enough
+# departures to last until the next one, see departures.departures_duration.
+TICK = "--tick" in sys.argv
+POLL = int(option("poll", 5 * 60 if TICK else 50))
 
 # sys.path.append('~/e-Paper/RaspberryPi_JetsonNano/python/lib/')
 
-if DEBUG:
-    import tkinter as tk
-else:
-    from waveshare_epd import epd7in5_HD
-
-locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)-8s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S')
+FONT_PATHS = {
+    "regular": "fonts/OpenSans-Regular.ttf",
+    "bold": "fonts/OpenSans-Bold.ttf",
+    "italic": "fonts/OpenSans-Italic.ttf",
+    "semibold": "fonts/OpenSans-SemiBold.ttf",
+    "semibold-italic": "fonts/OpenSans-SemiBoldItalic.ttf",
+    "condensed": "fonts/OpenSans-CondensedRegular.ttf",
+    "condensed-bold": "fonts/OpenSans-CondensedBold.ttf",
+    "condensed-bold-italic": "fonts/OpenSans-CondensedBoldItalic.ttf",
+}
+
+FONTS = {
+    "small-line": (FONT_PATHS["condensed-bold"], 22),
+    "large-line": (FONT_PATHS["condensed-bold"], 26),
+    "large-destination": (FONT_PATHS["semibold"], 32),
+    "small-destination": (FONT_PATHS["regular"], 27),
+    "large-arrival": (FONT_PATHS["regular"], 32),
+    "small-arrival": (FONT_PATHS["italic"], 27),
+    "claim": (FONT_PATHS["semibold-italic"], 17),
+    "clock": (FONT_PATHS["bold"], 71),
+    "date": (FONT_PATHS["italic"], 25),
+    "temperature": (FONT_PATHS["regular"], 90),
+    "forecast-hour": (FONT_PATHS["regular"], 30),
+    "forecast-temp": (FONT_PATHS["regular"], 21),
+    "sunrise": (FONT_PATHS["semibold"], 21)
+}
+
+# Sprites that are drawn on (almost) every frame
+SPRITES = [
+    ("img/bvg@2x-8.png", (40, 36), assets.WHITE, "L"),
+    ("img/S41@2x-8.png", (15, 17), assets.BLACK, "L"),
+    ("img/S42@2x-8.png", (15, 17), assets.BLACK, "L"),
+    ("img/sunrise.png", (52, 50), assets.WHITE, "L"),
+    ("img/fernsehturm-8.png", None, None, "RGBA"),
+    ("img/cloud-8.png", None, None, "RGBA"),
+]
+
+
+CLOUD_SIZE = (147, 86)
+
+# Clouds are drawn at one of these scales
+CLOUD_SCALES = (0.85, 0.9, 0.95, 1.0, 1.05, 1.1, 1.15)
+
+
+# Seconds until just after the next full minute
+def next_tick():
+    now = datetime.now()
+    return 60.5 - now.second - now.microsecond / 1e6
+
+
+sources = None
+
+
+# The sources every board shows. Each App adds its board's departures and
+# journeys, and all of them are polled on the scheduler's one event loop,
+# so boards watching the same stop or journey share the request pool's
+# in-flight requests and results. Started by main() once every App is set up.
+def shared_scheduler():
+    global sources
+    if sources is None:
+        sources = scheduler.Scheduler()
+        sources.add("claim", 20 * 60, departures.bvg_claim, "")
+        sources.add("typst-stars", 5 * 60, typst.get_typst_stars)
+        sources.add("typst-online", 60, typst.get_typst_online)
+        if FORECAST:
+            # Start with the forecast cached on disk until the first fetch
+            sources.add("forecast", 20 * 60,
+                        lambda: tuple(wetter.fetch_forecast()),
+                        tuple(wetter.cached_forecast()))
+    return sources
 
 
 class App:
     WIDTH, HEIGHT = (880, 528)
 
-    def __init__(self):
-        logging.info("Starting")
-
-        self.font_paths = {
-            "regular": "fonts/OpenSans-Regular.ttf",
-            "bold": "fonts/OpenSans-Bold.ttf",
-            "italic": "fonts/OpenSans-Italic.ttf",
-            "semibold": "fonts/OpenSans-SemiBold.ttf",
-            "semibold-italic": "fonts/OpenSans-SemiBoldItalic.ttf",
-            "condensed": "fonts/OpenSans-CondensedRegular.ttf",
-            "condensed-bold": "fonts/OpenSans-CondensedBold.ttf",
-            "condensed-bold-italic": "fonts/OpenSans-CondensedBoldItalic.ttf",
-        }
-
-        self.fonts = {
-            "small-line": ImageFont.truetype(self.font_paths["condensed-bold"], 22),
-            "large-line": ImageFont.truetype(self.font_paths["condensed-bold"], 26),
-            "large-destination": ImageFont.truetype(self.font_paths["semibold"], 32),
-            "small-destination": ImageFont.truetype(self.font_paths["regular"], 27),
-            "large-arrival": ImageFont.truetype(self.font_paths["regular"], 32),
-            "small-arrival": ImageFont.truetype(self.font_paths["italic"], 27),
-            "claim": ImageFont.truetype(self.font_paths["semibold-italic"], 17),
-            "clock": ImageFont.truetype(self.font_paths["bold"], 71),
-            "date": ImageFont.truetype(self.font_paths["italic"], 25),
-            "temperature": ImageFont.truetype(self.font_paths["regular"], 90),
-            "forecast-hour": ImageFont.truetype(self.font_paths["regular"], 30),
-            "forecast-temp": ImageFont.truetype(self.font_paths["regular"], 21),
-            "sunrise": ImageFont.truetype(self.font_paths["semibold"], 21)
-        }
+    def __init__(self, backend, board="home"):
+        logging.info(f"Starting board {board}")
+        self.board_name = board
+
+        self.fonts = assets.Fonts(FONTS)
 
         self.im = Image.new('L', (self.WIDTH, self.HEIGHT), 255)
         self.cv = ImageDraw.Draw(self.im)
         self.cv.text((self.WIDTH / 2, self.HEIGHT / 2), "Initializing ...", 0,
                      font=self.fonts["small-destination"], anchor="mm", align="center")
 
-        if DEBUG:
-            self.root = tk.Tk()
-            self.root.geometry(f"{self.WIDTH}x{self.HEIGHT}")
-            self.tkimg = ImageTk.PhotoImage(self.im)
-            self.label = tk.Label(self.root, image=self.tkimg)
-            self.label.pack()
+        self.last_frame = None
+        self.badges = {}
+        self.night_layers = {}
+        self.night_background = (None, None)
+        self.cloud_masks = None
 
-        else:
-            self.epd = epd7in5_HD.EPD()
-            self.epd.init()
-            self.epd.Clear()
-            self.swap()
+        self.backend = backend
+        self.backend.open((self.WIDTH, self.HEIGHT))
+        self.swap()
 
-        self.transit = departures.DepartureRetainer()
-        self.last_forecast = datetime.now(pytz.utc) - relativedelta(hours=24)
-        self.forecast = []
+        # Everything from here on happens after the first frame is shown
+        assets.preload(SPRITES)
+        self.start_sources()
+
+    def start_sources(self):
+        self.board = departures.BOARDS[self.board_name]
+        self.transit = departures.DepartureRetainer(
+            self.board, duration=departures.departures_duration(POLL) if TICK else departures.DURATION)
+        self.forecast = ()
         self.claim = ""
 
+        self.scheduler = shared_scheduler()
+        self.scheduler.add(self.source("departures"), POLL, self.transit.fetch_departures)
+        self.scheduler.add(self.source("journeys"), 50, self.transit.fetch_journeys)
+
+        # Show what an earlier run stored until the first fetch is through
+        warm = self.transit.departures_snapshot()
+        if warm is not None:
+            self.scheduler.put(self.source("departures"), warm)
+            self.scheduler.put(self.source("journeys"), self.transit.journeys_snapshot())
+
+    # Name of this board's snapshot of a source in the scheduler
+    def source(self, name):
+        return f"{name}:{self.board_name}"
+
     def refresh(self):
         logging.info("Refreshing")
 
-        self.im = Image.new('L', (self.WIDTH, self.HEIGHT), 255)
-        self.cv = ImageDraw.Draw(self.im)
+        with metrics.frame():
+            self.render()
+            self.swap()
 
-        now = datetime.now(pytz.utc)
-        if now - relativedelta(minutes=20) > self.last_forecast:
-            # self.forecast = wetter.fetch_forecast()
-            self.claim = departures.bvg_claim()
-            self.last_forecast = now
+        if METRICS_FILE is not None:
+            metrics.write_textfile(METRICS_FILE)
+
+    @metrics.timed("render")
+    def render(self):
+        # Every frame is drawn into the same image
+        self.im.paste(255, (0, 0, self.WIDTH, self.HEIGHT))
 
-        depts, night = self.transit.get_display_data()
+        # Only read the latest snapshots, fetching happens in the background
+        self.forecast = self.scheduler.get("forecast", ())
+        self.claim = self.scheduler.get("claim")
+
+        depts, night = departures.get_display_data(
+            self.scheduler.get(self.source("departures")),
+            self.scheduler.get(self.source("journeys")), self.board)
         if night:
             logging.info("Showing in night mode")
 
@@ -116,39 +209,36 @@ class App:
             self.draw_departure_board((91, 28), depts, night=True)
             self.draw_clock((445, 373), sunrise=True)
 
-        self.swap()
-
-        if DEBUG:
-            self.root.after(1000 * REFRESH, self.refresh)
-
     def loop(self):
-        if DEBUG:
-            self.root.after(100, self.refresh)
-            self.root.mainloop()
-
-        else:
-            while True:
-                self.refresh()
-                sleep(REFRESH)
+        # Give the first fetch a moment so we don't start with an empty board
+        self.scheduler.wait(self.source("departures"), 10)
+        self.backend.run(self.refresh, next_tick if TICK else REFRESH)
 
+    @metrics.timed("swap")
     def swap(self):
-        logging.info("Swapping")
+        # Compare what the panel would show, i.e. after dithering to 1 bit
+        frame = self.im.convert('1')
+        boxes = None
+        if self.last_frame is not None:
+            boxes = display.changed_boxes(self.last_frame, frame)
+            if len(boxes) == 0:
+                logging.info("Frame unchanged, skipping swap")
+                return
 
-        if DEBUG:
-            self.tkimg = ImageTk.PhotoImage(self.im)
-            self.label.configure(image=self.tkimg)
-        else:
-            self.epd.display(self.epd.getbuffer(self.im))
+        logging.info("Swapping")
+        self.backend.show(self.im, frame, boxes)
+        self.last_frame = frame
 
+    @metrics.timed("draw_departure_board")
     def draw_departure_board(self, pos, depts, night=False):
         x_pos, y_pos = pos
 
         for d in depts:
-            self.draw_line(d["product"], d["line"], d["destination"],
-                           d["departures"], (x_pos, y_pos), wide=night)
+            self.draw_line(d.product, d.line, d.destination,
+                           d.departures, (x_pos, y_pos), wide=night)
 
             two_ring = False
-            conns = d["connections"]
+            conns = d.connections
             for (i, c) in enumerate(conns):
                 if c is None:
                     continue
@@ -158,7 +248,7 @@ class App:
                 elif not two_ring:
                     y_pos += 45
 
-                if c["line"] == "S42" and len(conns) > i + 1 and conns[i + 1]["line"] == "S41":
+                if c.line == "S42" and len(conns) > i + 1 and conns[i + 1] is not None and conns[i + 1].line == "S41":
                     two_ring = True
 
                 if two_ring:
@@ -166,26 +256,27 @@ class App:
                 else:
                     width = 450
 
-                if two_ring and c["line"] != "S42":
+                if two_ring and c.line != "S42":
                     two_ring = False
                     x_offset = 225
                 else:
                     x_offset = 0
 
-                self.draw_line(c["product"], c["line"], c["destination"], [
-                               c["stopover"]], (x_pos + x_offset, y_pos), True, wide=night, width_preset=width)
+                self.draw_line(c.product, c.line, c.destination, [
+                               c.stopover], (x_pos + x_offset, y_pos), True, wide=night, width_preset=width)
 
             y_pos += 68
 
         if not night and len(depts) > 0:
-            icon = remove_transparency(Image.open(
-                f"img/bvg@2x-8.png")).resize((40, 36))
+            icon = assets.load("img/bvg@2x-8.png",
+                               (40, 36), assets.WHITE, "L")
             self.im.paste(icon, (x_pos, y_pos - 8))
             self.cv.text((x_pos + 61, y_pos + 16), self.claim, 0,
                          font=self.fonts["claim"], anchor="ls", align="left")
 
         return night
 
+    @metrics.timed("draw_line")
     def draw_line(self, product, line, destination, departures, pos, correspondance=False, wide=False, width_preset=450):
         orig_x = pos[0]
         if correspondance:
@@ -214,7 +305,19 @@ class App:
         self.cv.text((width + orig_x, pos[1] + round(dimensions[1] * 0.869143)), ", ".join(
             departures), 0, font=self.fonts[tme_font], anchor="rs", align="right")
 
+    @metrics.timed("draw_line_indicator")
     def draw_line_indicator(self, product, line, pos, compact=False, small=True):
+        key = (product, line, small, compact)
+        if key not in self.badges:
+            self.badges[key] = self.render_line_indicator(*key)
+
+        (mask, offset, dimensions) = self.badges[key]
+        self.im.paste(0, (pos[0] + offset[0], pos[1] + offset[1]), mask)
+        return dimensions
+
+    # Draws a line badge once into a tile and returns it as an ink mask with
+    # its offset from the badge's top left corner
+    def render_line_indicator(self, product, line, small, compact):
         if small:
             height = 27
             font = "small-line"
@@ -227,12 +330,18 @@ class App:
         else:
             width = round(height * 1.592592593)
 
+        # Leave room for line names that are wider than the badge
+        margin = height
+        tile = Image.new('L', (width + 2 * margin, height + 2 * margin), 255)
+        cv = ImageDraw.Draw(tile)
+        pos = (margin, margin)
+
         if product == "suburban":
-            self.cv.ellipse([pos, (pos[0] + height, pos[1] + height)], fill=0)
-            self.cv.ellipse([(pos[0] + width - height, pos[1]),
-                            (pos[0] + width, pos[1] + height)], fill=0)
-            self.cv.rectangle([(pos[0] + height / 2, pos[1]),
-                              (pos[0] + width - height / 2, pos[1] + height)], fill=0)
+            cv.ellipse([pos, (pos[0] + height, pos[1] + height)], fill=0)
+            cv.ellipse([(pos[0] + width - height, pos[1]),
+                        (pos[0] + width, pos[1] + height)], fill=0)
+            cv.rectangle([(pos[0] + height / 2, pos[1]),
+                          (pos[0] + width - height / 2, pos[1] + height)], fill=0)
         else:
             fill = 0
             outline = None
@@ -240,7 +349,7 @@ class App:
                 fill = 255
                 outline = 0
 
-            self.cv.rectangle(
+            cv.rectangle(
                 [pos, (pos[0] + width, pos[1] + height)], fill=fill, outline=outline, width=2)
 
         fill = 255
@@ -248,16 +357,20 @@ class App:
             fill = 0
 
         if line == "S41" or line == "S42":
-            icon = remove_transparency(Image.open(
-                f"img/{line}@2x-8.png"), (0, 0, 0)).resize((15, 17))
-            self.im.paste(
+            icon = assets.load(f"img/{line}@2x-8.png",
+                               (15, 17), assets.BLACK, "L")
+            tile.paste(
                 icon, (pos[0] + round(width / 2 - 7.5), pos[1] + round(height * 0.185185)))
         else:
-            self.cv.text((pos[0] + ceil(width / 2 + .5), pos[1] + round(height * 0.814815)),
-                         line, fill, font=self.fonts[font], anchor="ms", align="center")
-        return (width, height)
+            cv.text((pos[0] + ceil(width / 2 + .5), pos[1] + round(height * 0.814815)),
+                    line, fill, font=self.fonts[font], anchor="ms", align="center")
+
+        mask = ImageOps.invert(tile)
+        bbox = mask.getbbox() or (0, 0, 1, 1)
+        return (mask.crop(bbox), (bbox[0] - margin, bbox[1] - margin), (width, height))
 
     # pos is the top center point
+    @metrics.timed("draw_clock")
     def draw_clock(self, pos, sunrise=False):
         clock_y = pos[1] + 51
         self.cv.text((pos[0], clock_y), datetime.now().strftime(
@@ -266,41 +379,45 @@ class App:
                      0, font=self.fonts["date"], anchor="ms", align="center")
 
         if sunrise:
-            icon = remove_transparency(Image.open(
-                f"img/sunrise.png")).resize((52, 50))
+            icon = assets.load("img/sunrise.png", (52, 50), assets.WHITE, "L")
             self.im.paste(icon, (pos[0] - 52, pos[1] + 100))
-            self.cv.text((pos[0] - 2, pos[1] + 133), sun(astro.city.observer, date=datetime.now(pytz.utc), tzinfo=astro.city.timezone)[
-                         "sunrise"].strftime("%H:%M"), 0, font=self.fonts["sunrise"], anchor="ls", align="left")
+            sunrise_time = astro.ephemeris(datetime.now(pytz.utc)).sunrise
+            self.cv.text((pos[0] - 2, pos[1] + 133), sunrise_time.strftime("%H:%M"),
+                         0, font=self.fonts["sunrise"], anchor="ls", align="left")
 
+    @metrics.timed("draw_forecast")
     def draw_forecast(self, pos):
         self.draw_hero_forecast(pos)
         self.draw_hourly_forecast((pos[0] + 45, pos[1] + 129))
 
+    @metrics.timed("draw_typst_info")
     def draw_typst_info(self, pos):
-        stars = typst.get_typst_stars()
+        stars = self.scheduler.get("typst-stars")
         if stars is not None:
             self.cv.text((pos[0], pos[1] + 88), f"{stars}",
                          0, font=self.fonts["temperature"], anchor="ls", align="center")
             self.cv.text((pos[0] + 32, pos[1] + 120), "stars on typst/typst",
                          0, font=self.fonts["sunrise"], anchor="ls", align="left")
 
-        online = typst.get_typst_online()
+        online = self.scheduler.get("typst-online")
         if online is not None:
             self.cv.text((pos[0], pos[1] + 315), f"{online} online on typst.app",
                          0, font=self.fonts["forecast-temp"], anchor="ls", align="left")
 
+    @metrics.timed("draw_hero_forecast")
     def draw_hero_forecast(self, pos):
         if len(self.forecast) <= 0:
             return
 
         forecast = self.forecast[0]
-        # icon = remove_transparency(Image.open(
-        #     f"img/{wetter.get_icon(forecast)}.png")).resize((110, 110))
+        # icon = assets.load(f"img/{wetter.get_icon(forecast)}.png",
+        #                    (110, 110), assets.WHITE, "L")
         # self.im.paste(icon, pos)
 
         self.cv.text((pos[0] + 115, pos[1] + 88), f"{round(forecast['temperature'])}°",
                      0, font=self.fonts["temperature"], anchor="ls", align="left")
 
+    @metrics.timed("draw_hourly_forecast")
     def draw_hourly_forecast(self, pos):
         if len(self.forecast) <= 1:
             return
@@ -309,76 +426,125 @@ class App:
         for f in self.forecast[1:5]:
             self.cv.text((pos[0] - 10, pos_y + 37), f["time"].strftime("%H Uhr"),
                          0, font=self.fonts["forecast-hour"], anchor="ls", align="left")
-            # icon = remove_transparency(Image.open(
-            #     f"img/{wetter.get_icon(f)}.png")).resize((48, 48))
+            # icon = assets.load(f"img/{wetter.get_icon(f)}.png",
+            #                    (48, 48), assets.WHITE, "L")
             # self.im.paste(icon, (pos[0] + 98, pos_y + 3))
             self.cv.text((pos[0] + 180, pos_y + 37), f"{round(f['temperature'])}°",
                          0, font=self.fonts["forecast-temp"], anchor="rs", align="right")
             pos_y += 58
 
+    @metrics.timed("draw_background")
     def draw_background(self):
-        bg_height = round(self.HEIGHT * 0.65)
-        background = Image.new(
-            'RGBA', (self.WIDTH, bg_height), (255, 255, 255, 0))
-
-        tv_tower = Image.open("img/fernsehturm-8.png")
-        background.paste(
-            tv_tower, (round(self.WIDTH * 0.845), bg_height - 218))
-
-        moon_phase = astro.get_moon_phase(
-            datetime.now(pytz.utc)).graphic_string()
-
-        if moon_phase != "new":
-            moon = Image.open(
-                f"img/moon_l_{moon_phase}-8.png").resize((200, 200))
-            background.paste(moon, (round(self.WIDTH * 0.0625), -20))
+        now = datetime.now(pytz.utc)
+        moon_phase = astro.ephemeris(now).moon.graphic_string()
 
         cloud_cover = 30
+        hour = now.replace(minute=0, second=0, microsecond=0)
         if len(self.forecast) > 0:
             cloud_cover = self.forecast[0]["cloud_cover"]
+            hour = self.forecast[0]["time"]
 
         cloud_amount = max(min(7*cloud_cover/73 - 84/73, 7), 0)
-        cloud = Image.open(f"img/cloud-8.png")
-        cloud_dimensions = (147, 86)
-        cloud_band = 48
-
-        for _ in range(round(cloud_amount)):
-            scale = random() * .3 + .85
-            left = round(random() * self.WIDTH - cloud_dimensions[0] / 2)
-            offset = round(random() * cloud_band)
-            resized = cloud.resize(
-                (round(cloud_dimensions[0] * scale), round(cloud_dimensions[1] * scale)))
-            background.paste(resized, (left, 15+offset),
-                             resized.convert('RGBA'))
 
-        self.im.paste(remove_transparency(background),
-                      (0, self.HEIGHT - bg_height))
+        # The clouds only change with the forecast hour, so the background is
+        # the same for every frame in between
+        key = (moon_phase, hour, round(cloud_amount))
+        if self.night_background[0] != key:
+            background = self.night_layer(moon_phase).copy()
+            self.draw_clouds(background, round(cloud_amount),
+                             Random(int(hour.timestamp())))
+            self.night_background = (key, background)
 
+        background = self.night_background[1]
+        self.im.paste(background, (0, self.HEIGHT - background.height))
 
-def remove_transparency(im, bg_colour=(255, 255, 255)):
-    # Only process if image has transparency (http://stackoverflow.com/a/1963146)
-    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+    # TV tower and moon, flattened onto white
+    def night_layer(self, moon_phase):
+        if moon_phase in self.night_layers:
+            return self.night_layers[moon_phase]
 
-        # Need to convert to RGBA if LA format due to a bug in PIL (http://stackoverflow.com/a/1963146)
-        alpha = im.convert('RGBA').split()[-1]
-
-        # Create a new background image of our matt color.
-        # Must be RGBA because paste requires both images have the same format
-        # (http://stackoverflow.com/a/8720632  and  http://stackoverflow.com/a/9459208)
-        bg = Image.new("RGBA", im.size, bg_colour + (255,))
-        bg.paste(im, mask=alpha)
-        return bg
+        bg_height = round(self.HEIGHT * 0.65)
+        background = Image.new(
+            'RGBA', (self.WIDTH, bg_height), (255, 255, 255, 0))
 
-    else:
-        return im
+        tv_tower = assets.load("img/fernsehturm-8.png", mode="RGBA")
+        background.paste(
+            tv_tower, (round(self.WIDTH * 0.845), bg_height - 218))
 
+        if moon_phase != "new":
+            moon = assets.load(
+                f"img/moon_l_{moon_phase}-8.png", (200, 200), mode="RGBA")
+            background.paste(moon, (round(self.WIDTH * 0.0625), -20))
 
-try:
-    app = App()
-    app.loop()
+        layer = assets.remove_transparency(background).convert('L')
+        self.night_layers[moon_phase] = layer
+        return layer
 
-except Exception:
-    logging.exception("Fatal exception")
+    def draw_clouds(self, background, count, rng):
+        masks = self.cloud_atlas()
+        cloud_band = 48
 
-    if not DEBUG:
-        epd7in5_HD.epdconfig.module_exit()
+        for _ in range(count):
+            mask = rng.choice(masks)
+            left = round(rng.random() * self.WIDTH - CLOUD_SIZE[0] / 2)
+            offset = round(rng.random() * cloud_band)
+            background.paste(0, (left, 15+offset), mask)
+
+    # Masks of the cloud at each of CLOUD_SCALES, made once
+    def cloud_atlas(self):
+        if self.cloud_masks is None:
+            cloud = assets.load("img/cloud-8.png", mode="RGBA")
+            # Clouds used to be blended twice, cubing the alpha at the
+            # edges, keep them looking the same
+            cube = [round(a ** 3 / 255 ** 2) for a in range(256)]
+            self.cloud_masks = [
+                cloud.resize((round(CLOUD_SIZE[0] * scale), round(CLOUD_SIZE[1] * scale)))
+                .getchannel('A').point(cube)
+                for scale in CLOUD_SCALES]
+
+        return self.cloud_masks
+
+
+def main():
+    locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)-8s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    if METRICS_PORT is not None:
+        metrics.serve(int(METRICS_PORT))
+
+    boards = BOARD.split(",")
+    displays = DISPLAY.split(",")
+    if len(displays) != len(boards):
+        sys.exit(f"Got {len(boards)} boards but {len(displays)} displays")
+
+    outputs = [backends.create(spec) for spec in displays]
+    try:
+        apps = [App(backend, board) for (backend, board) in zip(outputs, boards)]
+        metrics.collectors.append(
+            lambda: metrics.endpoint_lines(departures.shared_pool().stats()))
+        shared_scheduler().start()
+
+        # The first board runs on the main thread, which Tk needs
+        for app in apps[1:]:
+            threading.Thread(target=run, args=(app,), name=app.board_name, daemon=True).start()
+        apps[0].loop()
+
+    except Exception:
+        logging.exception("Fatal exception")
+        for backend in outputs:
+            backend.close()
+
+
+def run(app):
+    try:
+        app.loop()
+    except Exception:
+        logging.exception(f"Fatal exception on board {app.board_name}")
+        app.backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+import requests
+
+session = requests.Session()
+
+
+# A single HTTP resource that is kept in memory. get() always answers from
+# the cache; once the value is older than ttl it is revalidated in the
+# background with If-None-Match/If-Modified-Since while the stale value is
+# still being served. With a store.Store, the value and its validators are
+# also kept on disk, so after a restart get() answers right away.
+class CachedResource:
+    # name is used for logging and as the key in the store, so that secret
+    # URLs don't end up in the log or on disk
+    def __init__(self, name, url, parse, ttl, timeout=5, headers=None, store=None):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.ttl = ttl
+        self.timeout = timeout
+        self.headers = headers or {}
+
+        self.value = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+        self.store = store
+        entry = None if store is None else store.get(name)
+        if entry is not None and isinstance(entry.value, list) and len(entry.value) == 3:
+            (self.value, self.etag, self.last_modified) = entry.value
+
+    def is_stale(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl
+
+    def get(self):
+        # Nothing to serve yet, so the very first call has to wait
+        if self.fetched_at is None and self.value is None:
+            self.revalidate()
+        elif self.is_stale():
+            self.revalidate_in_background()
+
+        return self.value
+
+    def revalidate_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        threading.Thread(target=self.revalidate, daemon=True).start()
+
+    def revalidate(self):
+        headers = dict(self.headers)
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+
+        try:
+            resp = session.get(self.url, headers=headers, timeout=self.timeout)
+
+            if resp.status_code == 304:
+                self.fetched_at = time.monotonic()
+                self.save()
+            elif resp.status_code == 200:
+                self.value = self.parse(resp)
+                self.etag = resp.headers.get("ETag")
+                self.last_modified = resp.headers.get("Last-Modified")
+                self.fetched_at = time.monotonic()
+                self.save()
+            else:
+                logging.warning(
+                    f"Failed to revalidate {self.name}: HTTP {resp.status_code}")
+        except Exception:
+            logging.warning(f"Failed to revalidate {self.name}")
+        finally:
+            self.refreshing = False
+
+    def save(self):
+        if self.store is not None:
+            self.store.put(self.name, (self.value, self.etag, self.last_modified), self.ttl)
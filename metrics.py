@@ -0,0 +1,182 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Number of recent samples per stage kept for the rolling quantiles
+WINDOW = 100
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Warn about frames that take longer than this to render and swap
+FRAME_BUDGET = 1.0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q):
+        recent = sorted(self.recent)
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+
+stages = {}
+lock = threading.Lock()
+
+# Stage durations of the frame being rendered on this thread, see frame(),
+# and the time spent in nested stages of the stages running on it
+local = threading.local()
+
+# Functions returning more lines for the metrics text, e.g. endpoint_lines
+collectors = []
+
+
+# own is the time not spent in nested stages, which is what a frame's stages
+# are ranked by
+def observe(stage, seconds, own=None):
+    with lock:
+        if stage not in stages:
+            stages[stage] = Histogram()
+        stages[stage].observe(seconds)
+
+    current = getattr(local, "frame", None)
+    if current is not None:
+        current[stage] = current.get(stage, 0.0) + (seconds if own is None else own)
+
+
+# Records how long the block or decorated function takes under stage
+@contextmanager
+def timed(stage):
+    if not hasattr(local, "nested"):
+        local.nested = []
+    local.nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        nested = local.nested.pop()
+        if len(local.nested) > 0:
+            local.nested[-1] += duration
+        observe(stage, duration, duration - nested)
+
+
+# Times a whole frame and warns, naming the stages that took the most time
+# themselves (without their nested stages), if it is over budget
+@contextmanager
+def frame(budget=FRAME_BUDGET):
+    local.frame = {}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        durations = local.frame
+        local.frame = None
+        observe("frame", duration)
+
+        if duration > budget:
+            slowest = sorted(durations.items(), key=lambda s: s[1], reverse=True)[:3]
+            logging.warning(
+                f"Frame took {duration * 1e3:.0f} ms, over the budget of {budget * 1e3:.0f} ms. Slowest: "
+                + ", ".join(f"{name} {seconds * 1e3:.0f} ms" for (name, seconds) in slowest))
+
+
+def stage_lines():
+    lines = [
+        "# HELP flur_stage_seconds Time spent in each stage of the refresh loop",
+        "# TYPE flur_stage_seconds histogram",
+    ]
+    recent = [
+        "# HELP flur_stage_recent_seconds Quantiles of the last samples of each stage",
+        "# TYPE flur_stage_recent_seconds gauge",
+    ]
+
+    with lock:
+        for (stage, histogram) in sorted(stages.items()):
+            cumulative = 0
+            for (bound, count) in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'flur_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'flur_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'flur_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for q in QUANTILES:
+                recent.append(
+                    f'flur_stage_recent_seconds{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q)}')
+
+    return lines + recent
+
+
+# Takes policy counters by endpoint, e.g. from RequestPool.stats()
+def endpoint_lines(stats):
+    lines = []
+    names = sorted({k for counters in stats.values() for k in counters if k != "state"})
+    for name in names:
+        lines.append(f"# TYPE flur_endpoint_{name}_total counter")
+        for (endpoint, counters) in sorted(stats.items()):
+            lines.append(f'flur_endpoint_{name}_total{{endpoint="{endpoint}"}} {counters[name]}')
+
+    lines.append("# HELP flur_endpoint_open 1 while the circuit breaker skips requests")
+    lines.append("# TYPE flur_endpoint_open gauge")
+    for (endpoint, counters) in sorted(stats.items()):
+        lines.append(f'flur_endpoint_open{{endpoint="{endpoint}"}} {int(counters["state"] == "open")}')
+
+    return lines
+
+
+# Everything in the Prometheus text format
+def text():
+    lines = stage_lines()
+    for collect in collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+# For node_exporter's textfile collector, which must never see half a file
+def write_textfile(path):
+    with open(path + ".tmp", "w") as f:
+        f.write(text())
+    os.replace(path + ".tmp", path)
+
+
+# Serves text() at /metrics
+def serve(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+
+            body = text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
@@ -1,26 +1,158 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from types import MappingProxyType
+from xml.etree import ElementTree
+import asyncio
+import html
+import logging
+import re
 import time
 
-import feedparser
+import httpx
 
-def parse_feed(url):
-    d = feedparser.parse(url)
 
-    return [{
-        "title": entry["title"],
-        "time": time.strftime("%H:%M", entry["updated_parsed"]),
-        "summary": entry["summary"]
-    } for entry in d.entries[:3]]
+# A feed of which only the first entries are kept. It is asked for again
+# after ttl seconds, with If-None-Match/If-Modified-Since.
+class Feed:
+    def __init__(self, name, url, ttl=10 * 60, entries=3, timeout=10):
+        self.name = name
+        self.url = url
+        self.ttl = ttl
+        self.entries = entries
+        self.timeout = timeout
 
-def tagesschau():
-    return parse_feed("https://www.tagesschau.de/xml/atom/")
+        self.items = ()
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
 
-def tagesspiegel():
-    return parse_feed("https://www.tagesspiegel.de/contentexport/feed/home")
+    def is_stale(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl
 
-def new_york_times():
-    return parse_feed("https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml")
+    async def refresh(self, client):
+        try:
+            await asyncio.wait_for(self.revalidate(client), self.timeout)
+        except (httpx.HTTPError, asyncio.TimeoutError, ElementTree.ParseError) as e:
+            logging.warning(f"Failed to fetch {self.name}: {e!r}")
 
-def bz_local():
-    return parse_feed("https://www.berliner-zeitung.de/feed.id_mensch_und_metropole.xml")
+    async def revalidate(self, client):
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
 
-# print(new_york_times())
+        async with client.stream("GET", self.url, headers=headers) as response:
+            if response.status_code == 304:
+                self.fetched_at = time.monotonic()
+                return
+
+            if response.status_code != 200:
+                logging.warning(f"Failed to fetch {self.name}: HTTP {response.status_code}")
+                return
+
+            items = await read_entries(response, self.entries)
+            self.items = tuple(items)
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            self.fetched_at = time.monotonic()
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# Parses the RSS or Atom document while it arrives and stops reading once
+# count entries are complete
+async def read_entries(response, count):
+    parser = ElementTree.XMLPullParser(events=("end",))
+    items = []
+
+    async for chunk in response.aiter_bytes():
+        parser.feed(chunk)
+        for (_, element) in parser.read_events():
+            if local_name(element.tag) not in ("item", "entry"):
+                continue
+
+            items.append(parse_entry(element))
+            element.clear()
+            if len(items) >= count:
+                return items
+
+    return items
+
+
+TAGS = re.compile(r"<[^>]+>")
+
+
+def parse_entry(element):
+    fields = {}
+    for child in element:
+        name = local_name(child.tag)
+        if name not in fields:
+            fields[name] = "".join(child.itertext()).strip()
+
+    published = next((fields[k] for k in ("updated", "published", "pubDate", "date")
+                      if fields.get(k)), None)
+    summary = next((fields[k] for k in ("summary", "description", "content")
+                    if fields.get(k)), "")
+
+    return {
+        "title": html.unescape(fields.get("title", "")),
+        "time": None if published is None else parse_date(published),
+        "summary": html.unescape(TAGS.sub("", summary)).strip(),
+    }
+
+
+# Atom uses ISO 8601, RSS the e-mail date format. Returns the time of day
+# in UTC like feedparser's *_parsed fields, or None.
+def parse_date(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%H:%M")
+
+
+FEEDS = [
+    Feed("tagesschau", "https://www.tagesschau.de/xml/atom/"),
+    Feed("tagesspiegel", "https://www.tagesspiegel.de/contentexport/feed/home"),
+    Feed("new_york_times", "https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml"),
+    Feed("bz_local", "https://www.berliner-zeitung.de/feed.id_mensch_und_metropole.xml"),
+]
+
+
+# Keeps the newest entries of each feed. fetch() refreshes the stale feeds
+# concurrently and returns an immutable snapshot for the scheduler.
+class News:
+    def __init__(self, feeds=FEEDS):
+        self.feeds = feeds
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(follow_redirects=True)
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def fetch(self):
+        stale = [feed for feed in self.feeds if feed.is_stale()]
+        if len(stale) > 0:
+            logging.info(f"Fetching {len(stale)} news feeds")
+            client = self.get_client()
+            await asyncio.gather(*[feed.refresh(client) for feed in stale])
+
+        return MappingProxyType({feed.name: feed.items for feed in self.feeds})
+
+
+# print(asyncio.run(News().fetch())["new_york_times"])
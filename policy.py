@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+
+
+# Allows rate requests per second on average and bursts of up to burst
+# requests. Only used from one event loop, so there is no locking.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # Waits for a token and returns how long that took
+    async def take(self):
+        waited = 0.0
+        while not self.try_take():
+            delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+
+# Requests to one API endpoint, with a circuit breaker: after threshold
+# failures in a row no requests are made for a backoff period that doubles
+# every time the breaker opens again (with jitter, so several clients don't
+# retry in lockstep). Then a single trial request is let through, and its
+# outcome closes the breaker again or starts the next backoff period.
+# Requests that were already under way when the breaker opened don't count.
+class Endpoint:
+    def __init__(self, name, bucket=None, threshold=3, backoff=10, max_backoff=600):
+        self.name = name
+        self.bucket = bucket
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.trial = False
+
+        self.counters = {
+            "requests": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "rejected": 0,
+            "hedged": 0,
+            "latency_seconds": 0.0,
+            "throttled_seconds": 0.0,
+        }
+
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        if self.trial or time.monotonic() >= self.open_until:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        if self.failures < self.threshold:
+            return True
+        if self.trial or time.monotonic() < self.open_until:
+            return False
+
+        self.trial = True
+        return True
+
+    def succeeded(self):
+        if self.failures >= self.threshold:
+            logging.info(f"{self.name} is back")
+
+        self.failures = 0
+        self.trips = 0
+        self.trial = False
+        self.counters["succeeded"] += 1
+
+    # trial is whether the request was the one let through while half-open
+    def failed(self, retry_after=None, trial=False):
+        self.counters["failed"] += 1
+
+        if trial:
+            self.trial = False
+        elif self.failures >= self.threshold:
+            if retry_after is not None:
+                self.open_until = max(self.open_until, time.monotonic() + retry_after)
+            return
+
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.trips += 1
+            backoff = min(self.max_backoff,
+                          self.backoff * 2 ** (self.trips - 1))
+            backoff = random.uniform(backoff / 2, backoff)
+            if retry_after is not None:
+                backoff = max(backoff, retry_after)
+
+            self.open_until = time.monotonic() + backoff
+            logging.warning(
+                f"{self.name} failed {self.failures} times, pausing for {backoff:.0f}s")
+
+    def stats(self):
+        return dict(self.counters, state=self.state())
+
+    # Returns the response, or None if the request failed or was not made.
+    # timeout is a deadline for the whole request, not just for each read.
+    # With hedge_after, a second identical request is started if the first
+    # has not been answered after that many seconds, and whichever answers
+    # first wins.
+    async def get(self, client, url, timeout, hedge_after=None):
+        if not self.allow():
+            self.counters["rejected"] += 1
+            return None
+        trial = self.failures >= self.threshold
+
+        try:
+            if hedge_after is None:
+                response = await self.attempt(client, url, timeout)
+            else:
+                response = await self.hedged(client, url, timeout, hedge_after)
+        except asyncio.CancelledError:
+            if trial:
+                self.trial = False
+            raise
+
+        if response is None or response.status_code >= 500:
+            self.failed(trial=trial)
+        elif response.status_code == 429:
+            self.failed(retry_after(response), trial)
+        else:
+            self.succeeded()
+
+        return response
+
+    async def attempt(self, client, url, timeout, throttle=True):
+        if throttle and self.bucket is not None:
+            self.counters["throttled_seconds"] += await self.bucket.take()
+
+        self.counters["requests"] += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(client.get(url, timeout=timeout), timeout)
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            self.counters["timeouts"] += 1
+            logging.warning(f"Request to {self.name} timed out")
+        except httpx.HTTPError as e:
+            self.counters["errors"] += 1
+            logging.warning(f"Request to {self.name} failed: {e!r}")
+        finally:
+            self.counters["latency_seconds"] += time.monotonic() - start
+
+        return None
+
+    async def hedged(self, client, url, timeout, delay):
+        tasks = {asyncio.ensure_future(self.attempt(client, url, timeout))}
+        try:
+            (done, _) = await asyncio.wait(tasks, timeout=delay)
+
+            # A hedge is only worth it if it doesn't have to wait for the bucket
+            if len(done) == 0 and (self.bucket is None or self.bucket.try_take()):
+                self.counters["hedged"] += 1
+                tasks.add(asyncio.ensure_future(
+                    self.attempt(client, url, timeout, throttle=False)))
+
+            response = None
+            while len(tasks) > 0:
+                (done, tasks) = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    response = task.result()
+                    if response is not None and response.status_code < 500:
+                        return response
+            return response
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
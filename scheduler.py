@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import threading
+
+import metrics
+
+
+# Polls every source on its own cadence in a background thread. Each poll
+# replaces the source's snapshot as a whole, so readers only ever see
+# complete values and never have to wait for the network.
+class Scheduler:
+    def __init__(self):
+        self.sources = []
+        self.snapshots = {}
+        self.updated = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.run, name="scheduler", daemon=True)
+
+    # fetch may be a coroutine function or a blocking function, which is run
+    # in the loop's thread pool. Returning None keeps the previous snapshot.
+    def add(self, name, interval, fetch, default=None):
+        self.sources.append((name, interval, fetch))
+        self.snapshots[name] = default
+        self.updated[name] = threading.Event()
+
+    def get(self, name, default=None):
+        return self.snapshots.get(name, default)
+
+    def put(self, name, value):
+        self.snapshots[name] = value
+        self.updated.setdefault(name, threading.Event()).set()
+
+    # Block until the source has produced its first snapshot
+    def wait(self, name, timeout=None):
+        return self.updated[name].wait(timeout)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(
+            asyncio.gather(*[self.poll(*source) for source in self.sources]))
+
+    async def poll(self, name, interval, fetch):
+        while True:
+            try:
+                with metrics.timed(f"fetch_{name}"):
+                    if asyncio.iscoroutinefunction(fetch):
+                        value = await fetch()
+                    else:
+                        value = await self.loop.run_in_executor(None, fetch)
+
+                if value is not None:
+                    self.put(name, value)
+            except Exception:
+                logging.exception(f"Failed to refresh {name}")
+
+            await asyncio.sleep(interval)
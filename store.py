@@ -0,0 +1,96 @@
+from typing import NamedTuple
+import logging
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PATH = os.path.join("cache", "warm.sqlite")
+
+# Entries not written for this long are deleted when the store is opened
+MAX_AGE = 24 * 60 * 60
+
+
+class Entry(NamedTuple):
+    value: object
+    stored_at: float
+    expires_at: float
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+
+# Values that survive restarts, so the first frame after boot can be drawn
+# from disk. The SQLite database is in WAL mode, so several processes on the
+# same machine can read and write it at once. Values are stored as JSON, so
+# a process writing the file can't make another one run code. Each thread
+# gets its own connection. Failures are logged and treated like a missing
+# entry.
+class Store:
+    def __init__(self, path=PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL NOT NULL)")
+            self.local.connection = connection
+        return connection
+
+    # value must be JSON, it counts as fresh for ttl seconds
+    def put(self, key, value, ttl):
+        now = time.time()
+        try:
+            self.connection().execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now + ttl))
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to store {key}: {e}")
+
+    # Returns the Entry, fresh or not, unless it is older than max_age
+    def get(self, key, max_age=MAX_AGE):
+        try:
+            row = self.connection().execute(
+                "SELECT value, stored_at, expires_at FROM entries WHERE key = ?",
+                (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to read {key} from the store: {e}")
+            return None
+
+        if row is None or time.time() - row[1] > max_age:
+            return None
+
+        try:
+            value = json.loads(row[0])
+        except (TypeError, ValueError):
+            logging.warning(f"Invalid entry for {key} in the store")
+            return None
+
+        return Entry(value, row[1], row[2])
+
+    def prune(self, max_age=MAX_AGE):
+        try:
+            self.connection().execute(
+                "DELETE FROM entries WHERE stored_at < ?", (time.time() - max_age,))
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to prune the store: {e}")
+
+
+store = None
+
+
+def shared():
+    global store
+    if store is None:
+        store = Store()
+        store.prune()
+    return store
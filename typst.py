@@ -1,38 +1,47 @@
 import os
-import requests
 
-# Fetch the secret Typst route and return how many users are online
+from httpcache import CachedResource
+import store
+
+online = None
+stars = None
+
+
+# The response is returned as a string in the X clients, Y projects
+# format. We only care about the X clients part.
+def parse_online(resp):
+    return int(resp.text.split()[0])
+
+
+def parse_stars(resp):
+    return resp.json()["stargazers_count"]
 
 
+# Fetch the secret Typst route and return how many users are online
 def get_typst_online():
+    global online
+
     secret_url = os.environ.get("MONITOR_TYPST_SECRET_URL")
     if secret_url is None:
         return None
 
-    try:
-        resp = requests.get(secret_url)
-        if resp.status_code != 200:
-            return None
+    if online is None:
+        online = CachedResource("typst online", secret_url,
+                                parse_online, ttl=60, timeout=5, store=store.shared())
 
-        # The response is returned as a string in the X clients, Y projects
-        # format. We only care about the X clients part.
-        return int(resp.text.split()[0])
-    except Exception:
-        return None
+    return online.get()
 
 
-# Return the number of GitHub stars for the typst repository
+# Return the number of GitHub stars for the typst repository. Revalidated
+# requests that come back as 304 don't count against GitHub's rate limit.
 def get_typst_stars():
-    api_key = os.environ.get("MONITOR_GITHUB_API_KEY")
+    global stars
 
-    try:
-        url = "https://api.github.com/repos/typst/typst"
-        resp = requests.get(url, headers={
-                            "Authorization": "token " + api_key}) if api_key else requests.get(url)
+    if stars is None:
+        api_key = os.environ.get("MONITOR_GITHUB_API_KEY")
+        headers = {"Authorization": "token " + api_key} if api_key else {}
+        stars = CachedResource("typst stars", "https://api.github.com/repos/typst/typst",
+                               parse_stars, ttl=10 * 60, timeout=5, headers=headers,
+                               store=store.shared())
 
-        if resp.status_code != 200:
-            return None
-
-        return resp.json()["stargazers_count"]
-    except Exception:
-        return None
+    return stars.get()
@@ -1,15 +1,24 @@
 from datetime import datetime
 from enum import Enum
+import glob
 import logging
 import os
+import re
 import sys
 
-from astral.sun import sun, golden_hour
 from dateutil.relativedelta import relativedelta
-from wetterdienst.provider.dwd.mosmix import DwdMosmixRequest, DwdMosmixType
 import pytz
 import polars as pl
-from astro import MoonPhase, get_moon_phase, city
+import requests
+from astro import MoonPhase, ephemeris
+
+STATION = "10382"
+
+# DWD publishes every MOSMIX run for a station as MOSMIX_L_<issue>_<station>.kmz
+LISTING_URL = f"https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_L/single_stations/{STATION}/kml/"
+ISSUE_FORMAT = "%Y%m%d%H"
+
+CACHE_DIR = "cache"
 
 
 class PrecipitationType(Enum):
@@ -19,8 +28,11 @@ class PrecipitationType(Enum):
     SNOW = 3
 
 
-def fetch_forecast():
-    logging.info("Fetching forecast")
+def download_forecast():
+    # wetterdienst is slow to import, so only load it when we really need it
+    from wetterdienst.provider.dwd.mosmix import DwdMosmixRequest, DwdMosmixType
+
+    logging.info("Downloading forecast")
 
     logger = logging.getLogger()
     prev_stderr = sys.stderr
@@ -28,91 +40,196 @@ def fetch_forecast():
     sys.stderr = open(os.devnull, 'w')
     logger.setLevel(logging.WARN)
 
-    stations = DwdMosmixRequest(
-        parameter="large", mosmix_type=DwdMosmixType.LARGE).filter_by_station_id(station_id=10382)
-    response = next(stations.values.query())
-    logging.info("Processing forecast")
+    try:
+        stations = DwdMosmixRequest(
+            parameter="large", mosmix_type=DwdMosmixType.LARGE).filter_by_station_id(station_id=int(STATION))
+        response = next(stations.values.query())
+    finally:
+        sys.stderr = prev_stderr
+        logger.setLevel(prev_level)
 
-    df = response.df
-    now = datetime.now(pytz.utc)
+    return response.df
 
-    sys.stderr = prev_stderr
-    logger.setLevel(prev_level)
 
-    twentyfour = df.filter(pl.col("date") <= now + relativedelta(hours=25))
-    twentyfour = twentyfour.filter(pl.col("date") >= now)
+# Returns the issue time of the newest run on the DWD server
+def latest_issue():
+    resp = requests.get(LISTING_URL, timeout=10)
+    resp.raise_for_status()
 
-    cloud_selector = pl.col("parameter") == "cloud_cover_effective"
-    tempr_selector = pl.col("parameter") == "temperature_air_mean_200"
-    fog_selector = pl.col("parameter") == "probability_fog_last_1h"
-    thunder_selector = pl.col("parameter") == "probability_thunder_last_1h"
+    issues = re.findall(rf"MOSMIX_L_(\d{{10}})_{STATION}\.kmz", resp.text)
+    if len(issues) == 0:
+        return None
 
-    prec_selector = pl.col("parameter") == "probability_precipitation_last_1h"
+    return datetime.strptime(max(issues), ISSUE_FORMAT).replace(tzinfo=pytz.utc)
 
-    # Select precipitation type based on which of these is maximal
-    rain_selector = pl.col(
-        "parameter") == "probability_precipitation_liquid_last_1h"
-    snow_selector = pl.col(
-        "parameter") == "probability_precipitation_solid_last_1h"
-    frez_selector = pl.col(
-        "parameter") == "probability_precipitation_freezing_last_1h"
-    drizzle_selector = pl.col("parameter") == "probability_drizzle_last_1h"
 
-    forecast = []
+def cache_path(issue):
+    return os.path.join(CACHE_DIR, f"forecast-{STATION}-{issue.strftime(ISSUE_FORMAT)}.arrow")
 
-    temp_record = twentyfour.filter(tempr_selector)
-    cloud_record = twentyfour.filter(cloud_selector)["value"]
-    fog_record = twentyfour.filter(fog_selector)["value"]
-    thunder_record = twentyfour.filter(thunder_selector)["value"]
-    rain_record = twentyfour.filter(rain_selector)["value"]
-    snow_record = twentyfour.filter(snow_selector)["value"]
-    frez_record = twentyfour.filter(frez_selector)["value"]
-    drizzle_record = twentyfour.filter(drizzle_selector)["value"]
 
-    for i in range(min(len(twentyfour.filter(cloud_selector)), 24)):
-        time = temp_record["date"][i]
+# Returns (issue, path) of the newest cached forecast or None
+def newest_cached():
+    paths = sorted(glob.glob(os.path.join(CACHE_DIR, f"forecast-{STATION}-*.arrow")))
+    if len(paths) == 0:
+        return None
 
-        s = sun(city.observer, date=time, tzinfo=city.timezone)
+    issue = re.search(r"-(\d{10})\.arrow$", paths[-1]).group(1)
+    return (datetime.strptime(issue, ISSUE_FORMAT).replace(tzinfo=pytz.utc), paths[-1])
 
-        day = s["dawn"] < time and s["dusk"] > time
 
-        current = {
-            "temperature": round(temp_record["value"][i] - 273.15, 1),
-            "cloud_cover": cloud_record[i],
-            "foggy": fog_record[i] >= 50,
-            "thunderstorm": thunder_record[i] >= 60,
-            "daylight": day,
-            "moon": get_moon_phase(time),
-            "time": time,
-        }
+def store_forecast(frame, issue):
+    os.makedirs(CACHE_DIR, exist_ok=True)
 
-        prec = {
-            "probability": twentyfour.filter(prec_selector)["value"][i],
-            "kind": PrecipitationType.RAIN
-        }
+    path = cache_path(issue)
+    frame.write_ipc(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    for old in glob.glob(os.path.join(CACHE_DIR, f"forecast-{STATION}-*.arrow")):
+        if old != path:
+            os.remove(old)
+
+
+def load_forecast(path):
+    return pl.read_ipc(path, memory_map=True)
 
-        rain_prob = rain_record[i]
-        snow_prob = snow_record[i]
-        frez_prob = frez_record[i]
-        drizzle_prob = drizzle_record[i]
 
-        max_prob = max(rain_prob, snow_prob, frez_prob, drizzle_prob)
+# Returns the forecast from disk without touching the network, or an empty
+# list if nothing has been cached yet
+def cached_forecast():
+    cached = newest_cached()
+    if cached is None:
+        return []
 
-        if max_prob > rain_prob:
-            if max_prob == snow_prob:
-                prec["kind"] = PrecipitationType.SNOW
-            elif max_prob == frez_prob:
-                prec["kind"] = PrecipitationType.FREEZING
-            elif max_prob == drizzle_prob:
-                prec["kind"] = PrecipitationType.DRIZZLE
+    return to_records(upcoming(load_forecast(cached[1]), datetime.now(pytz.utc)))
 
-        current["precipitation"] = prec
 
-        # Add information about golden hour if weather is nice
-        if current["cloud_cover"] < 35 and current["precipitation"]["probability"] < 10:
-            golden = golden_hour(city.observer, time, tzinfo=city.timezone)[0]
-            if time <= golden and time + relativedelta(minutes=60) > golden:
-                current["golden_hour"] = golden
+def fetch_forecast():
+    logging.info("Fetching forecast")
+
+    cached = newest_cached()
+    try:
+        issue = latest_issue()
+    except Exception:
+        logging.warning("Failed to look up the latest MOSMIX run")
+        issue = None
+
+    if cached is not None and (issue is None or issue <= cached[0]):
+        frame = load_forecast(cached[1])
+    else:
+        df = download_forecast()
+        logging.info("Processing forecast")
+        frame = process_forecast(df)
+
+        # A made-up issue time could be later than the run and hide the
+        # next one, so without the listing the forecast is not cached
+        if issue is not None:
+            store_forecast(frame, issue)
+
+    return to_records(upcoming(frame, datetime.now(pytz.utc)))
+
+
+# MOSMIX parameters we use and the column names they get in the wide frame
+PARAMETERS = {
+    "temperature_air_mean_200": "temperature",
+    "cloud_cover_effective": "cloud_cover",
+    "probability_fog_last_1h": "fog",
+    "probability_thunder_last_1h": "thunder",
+    "probability_precipitation_last_1h": "precipitation",
+    # Select precipitation type based on which of these is maximal
+    "probability_precipitation_liquid_last_1h": "rain",
+    "probability_precipitation_solid_last_1h": "snow",
+    "probability_precipitation_freezing_last_1h": "freezing",
+    "probability_drizzle_last_1h": "drizzle",
+}
+
+
+# Sun and moon only change per day, so look them up once for every day in
+# the forecast instead of once per hour. Dates are UTC like the forecast.
+def sun_table(days):
+    rows = []
+    for day in days:
+        e = ephemeris(day)
+        rows.append({
+            "day": day,
+            "dawn": e.dawn.astimezone(pytz.utc),
+            "dusk": e.dusk.astimezone(pytz.utc),
+            "golden_start": e.golden_hour.astimezone(pytz.utc),
+            "moon": e.moon.value,
+        })
+
+    return pl.DataFrame(rows, schema={
+        "day": pl.Date,
+        "dawn": pl.Datetime("us", "UTC"),
+        "dusk": pl.Datetime("us", "UTC"),
+        "golden_start": pl.Datetime("us", "UTC"),
+        "moon": pl.Int8,
+    })
+
+
+# Turns the long MOSMIX frame into one row per hour of the whole run
+def process_forecast(df):
+    wide = (df
+            .filter(pl.col("parameter").is_in(list(PARAMETERS.keys())))
+            .with_columns(pl.col("date").cast(pl.Datetime("us", "UTC")))
+            .pivot(values="value", index="date", columns="parameter", aggregate_function="first")
+            .rename(PARAMETERS)
+            .sort("date")
+            .with_columns(pl.col("date").dt.date().alias("day")))
+
+    days = sun_table(wide["day"].unique().sort().to_list())
+    wide = wide.join(days, on="day", how="left")
+
+    probability = pl.max_horizontal("rain", "snow", "freezing", "drizzle")
+    kind = (pl.when(pl.col("rain") >= probability).then(PrecipitationType.RAIN.value)
+            .when(pl.col("snow") == probability).then(PrecipitationType.SNOW.value)
+            .when(pl.col("freezing") == probability).then(PrecipitationType.FREEZING.value)
+            .otherwise(PrecipitationType.DRIZZLE.value))
+
+    # Add information about golden hour if weather is nice
+    nice = (pl.col("cloud_cover") < 35) & (pl.col("precipitation") < 10)
+    golden = ((pl.col("date") <= pl.col("golden_start"))
+              & (pl.col("date") + pl.duration(minutes=60) > pl.col("golden_start")))
+
+    return wide.select(
+        pl.col("date").alias("time"),
+        (pl.col("temperature") - 273.15).round(1).alias("temperature"),
+        pl.col("cloud_cover"),
+        (pl.col("fog") >= 50).alias("foggy"),
+        (pl.col("thunder") >= 60).alias("thunderstorm"),
+        ((pl.col("dawn") < pl.col("date")) & (pl.col("dusk") > pl.col("date"))).alias("daylight"),
+        pl.col("moon"),
+        pl.col("precipitation").alias("precipitation_probability"),
+        kind.cast(pl.Int8).alias("precipitation_kind"),
+        pl.when(nice & golden).then(pl.col("golden_start")).otherwise(None).alias("golden_hour"),
+    )
+
+
+# The next 24 hours of a processed forecast
+def upcoming(frame, now):
+    return (frame
+            .filter((pl.col("time") >= now) & (pl.col("time") <= now + relativedelta(hours=25)))
+            .head(24))
+
+
+def to_records(frame):
+    forecast = []
+    for row in frame.iter_rows(named=True):
+        current = {
+            "temperature": row["temperature"],
+            "cloud_cover": row["cloud_cover"],
+            "foggy": row["foggy"],
+            "thunderstorm": row["thunderstorm"],
+            "daylight": row["daylight"],
+            "moon": MoonPhase(row["moon"]),
+            "time": row["time"],
+            "precipitation": {
+                "probability": row["precipitation_probability"],
+                "kind": PrecipitationType(row["precipitation_kind"]),
+            },
+        }
+
+        if row["golden_hour"] is not None:
+            current["golden_hour"] = row["golden_hour"]
 
         forecast.append(current)
 